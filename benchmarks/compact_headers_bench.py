@@ -0,0 +1,80 @@
+"""Measure how much compact header names shrink SIP messages on the WebSocket path.
+
+Complete call flows run over sip_loopback's in-memory network, once with long and once with
+compact header names. Every message the clients send is sized as a masked client WebSocket
+frame, both uncompressed and with permessage-deflate context takeover (RFC 7692) per connection.
+
+    python3 benchmarks/compact_headers_bench.py --flows 200
+"""
+import argparse
+import os
+import random
+import sys
+import zlib
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sip_loopback import FakeProxy, VirtualClockLoop, run_flows  # noqa: E402
+
+
+def frame_size(payload):
+    """Client frames carry a 4-byte mask on top of the 2, 4 or 10 byte header."""
+    if payload < 126:
+        return payload + 6
+    if payload < 65536:
+        return payload + 8
+    return payload + 14
+
+
+class MeasuringProxy(FakeProxy):
+    def __init__(self):
+        super().__init__()
+        self.messages = 0
+        self.raw = 0
+        self.framed = 0
+        self.deflated = 0
+        self.compressors = {}
+
+    def handle(self, end, message):
+        data = message.encode('utf-8')
+        compressor = self.compressors.setdefault(id(end), zlib.compressobj(wbits=-15))
+        # permessage-deflate drops the trailing 00 00 ff ff of each sync flush
+        compressed = len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+        self.messages += 1
+        self.raw += len(data)
+        self.framed += frame_size(len(data))
+        self.deflated += frame_size(compressed)
+        super().handle(end, message)
+
+
+def measure(flows, seed, compact_headers):
+    random.seed(seed)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        loop = VirtualClockLoop()
+        try:
+            completed, proxy = loop.run_until_complete(run_flows(flows, compact_headers=compact_headers,
+                                                                    proxy=MeasuringProxy()))
+        finally:
+            loop.close()
+    assert completed == flows, f"only {completed}/{flows} flows completed"
+    return proxy
+
+
+def main(flows, seed):
+    long_form = measure(flows, seed, False)
+    compact = measure(flows, seed, True)
+    print(f"{flows} flows, {long_form.messages} client messages each run")
+    print(f"{'headers':<10}{'raw B/msg':>11}{'WS B/msg':>10}{'deflate B/msg':>15}")
+    for name, proxy in (("long", long_form), ("compact", compact)):
+        print(f"{name:<10}{proxy.raw / proxy.messages:>11.1f}{proxy.framed / proxy.messages:>10.1f}"
+              f"{proxy.deflated / proxy.messages:>15.1f}")
+    print(f"saving: {100 * (1 - compact.framed / long_form.framed):.1f}% uncompressed,"
+          f" {100 * (1 - compact.deflated / long_form.deflated):.1f}% with permessage-deflate")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact header size benchmark.")
+    parser.add_argument('--flows', type=int, default=200, help='Number of caller/callee flows per run')
+    parser.add_argument('--seed', type=int, default=1, help='Seed shared by both runs')
+    args = parser.parse_args()
+    main(args.flows, args.seed)
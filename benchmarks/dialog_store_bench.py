@@ -0,0 +1,101 @@
+"""Bytes per dialog for DialogStore versus keeping the raw INVITE or 200 OK text alive.
+
+    python3 benchmarks/dialog_store_bench.py --dialogs 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from random import choices, seed
+from string import ascii_letters, digits
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sip_client import DialogStore  # noqa: E402
+
+INVITE = (
+    "INVITE sip:{callee}@192.168.21.45 SIP/2.0\r\n"
+    "Record-Route: <sip:192.168.21.45;lr>\r\n"
+    "Via: SIP/2.0/WS 192.168.21.50:{port};rport;branch=z9hG4bK{branch}\r\n"
+    "Max-Forwards: 70\r\n"
+    "From: <sip:{caller}@192.168.21.45>;tag={from_tag}\r\n"
+    "To: <sip:{callee}@192.168.21.45>\r\n"
+    "Call-ID: {call_id}\r\n"
+    "CSeq: 4711 INVITE\r\n"
+    "Contact: <sip:{caller}@192.168.21.50:{port};transport:ws>\r\n"
+    "Content-Type: application/sdp\r\n"
+    "Content-Length: 142\r\n\r\n"
+    "v=0\r\no=- 13760799956958020 13760799956958020 IN IP4 127.0.0.1\r\ns=-\r\n"
+    "c=IN IP4 192.168.21.45\r\nt=0 0\r\nm=audio 49170 RTP/AVP 0\r\na=rtpmap:0 PCMU/8000\r\n"
+)
+OK = (
+    "SIP/2.0 200 OK\r\n"
+    "Via: SIP/2.0/WS 192.168.21.50:{port};rport;branch=z9hG4bK{branch}\r\n"
+    "Record-Route: <sip:192.168.21.45;lr>\r\n"
+    "To: <sip:{callee}@192.168.21.45>;tag={to_tag}\r\n"
+    "From: <sip:{caller}@192.168.21.45>;tag={from_tag}\r\n"
+    "Call-ID: {call_id}\r\n"
+    "CSeq: 4711 INVITE\r\n"
+    "Contact: <sip:{callee}@192.168.21.51:{port};ob>\r\n"
+    "Content-Type: application/sdp\r\n"
+    "Content-Length: 164\r\n\r\n"
+    "v=0\r\no=- 13760799956958020 13760799956958021 IN IP4 192.168.21.45\r\ns=-\r\n"
+    "c=IN IP4 192.168.21.45\r\nt=0 0\r\nm=audio 49170 RTP/AVP 0\r\na=rtpmap:0 PCMU/8000\r\na=sendrecv\r\n"
+)
+
+
+def token(k):
+    return ''.join(choices(ascii_letters + digits, k=k))
+
+
+def calls(count):
+    for index in range(count):
+        yield dict(caller=1000 + index, callee=500000 + index, port=20000 + index % 40000, branch=token(10),
+                   from_tag=token(10), to_tag=token(10), call_id=token(20))
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, used
+
+
+def main(count):
+    # Both runs draw the same calls and create every string inside the traced region
+
+    def raw_messages(message):
+        # What call() used to hold: the INVITE on the callee side, the 200 OK on the caller side
+        seed(1)
+        return {f["call_id"]: message.format(**f) for f in calls(count)}
+
+    def store():
+        seed(1)
+        dialogs = DialogStore()
+        for f in calls(count):
+            dialogs.add(f["call_id"], f["from_tag"], f["to_tag"], 4711,
+                        f"sip:{f['callee']}@192.168.21.51:{f['port']};ob", ["sip:192.168.21.45;lr"], now=0)
+        return dialogs
+
+    print(f"{count} dialogs")
+    for side, message in (("callee, raw INVITE", INVITE), ("caller, raw 200 OK", OK)):
+        raw, raw_bytes = measure(lambda: raw_messages(message))
+        del raw
+        print(f"{side + ' text:':26}{raw_bytes / count:8.1f} bytes/dialog ({raw_bytes / 2 ** 20:.1f} MiB)")
+    dialogs, store_bytes = measure(store)
+    print(f"{'DialogStore records:':26}{store_bytes / count:8.1f} bytes/dialog ({store_bytes / 2 ** 20:.1f} MiB)")
+
+    started = time.perf_counter()
+    reaped = dialogs.reap(now=dialogs.ttl + dialogs.bucket)
+    print(f"reaped {reaped} expired dialogs in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dialog store memory benchmark.")
+    parser.add_argument('--dialogs', type=int, default=100000, help='Number of concurrent dialogs')
+    args = parser.parse_args()
+    main(args.dialogs)
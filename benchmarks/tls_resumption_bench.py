@@ -0,0 +1,87 @@
+"""Measure full versus resumed TLS handshakes for wss and tls reconnect storms.
+
+A self-signed certificate is generated with the openssl CLI, and local TLS and WSS servers
+stand in for Kamailio's tls.so listeners. Every client shares the process-wide session cache.
+
+    python3 benchmarks/tls_resumption_bench.py --clients 200
+"""
+import asyncio
+import argparse
+import io
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+from websockets.asyncio.server import serve
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sip_tls  # noqa: E402
+from sip_client import SIPClient  # noqa: E402
+from sip_tls import TLSSessionCache  # noqa: E402
+
+
+def self_signed(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+async def answer_tcp(reader, writer):
+    while await reader.read(4096):
+        writer.write(b"SIP/2.0 200 OK\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+    writer.close()
+
+
+async def answer_ws(websocket):
+    async for _ in websocket:
+        await websocket.send("SIP/2.0 200 OK\r\nContent-Length: 0\r\n\r\n")
+
+
+async def storm(connection_type, port, clients, cafile):
+    """Connect every client, send one REGISTER and read its answer, then drop the connection."""
+    for _ in range(clients):
+        client = SIPClient("localhost", port=port, connection_type=connection_type, tls_cafile=cafile)
+        client.generate_call_id()
+        await client.create_socket()
+        await client.register()
+        await client.receive_message()
+        await client.drop_connection()
+
+
+async def main(clients):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = self_signed(directory)
+        server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_context.load_cert_chain(cert, key)
+
+        tls_server = await asyncio.start_server(answer_tcp, "localhost", 0, ssl=server_context)
+        tls_port = tls_server.sockets[0].getsockname()[1]
+        async with serve(answer_ws, "localhost", 0, ssl=server_context, subprotocols=["sip"]) as wss_server:
+            wss_port = wss_server.sockets[0].getsockname()[1]
+            for connection_type, port in (("tls", tls_port), ("wss", wss_port)):
+                # A fresh cache per run keeps the two transports' counts apart
+                sip_tls.TLS_SESSIONS = TLSSessionCache()
+                with redirect_stdout(io.StringIO()):
+                    await storm(connection_type, port, clients, cert)
+                stats = sip_tls.TLS_SESSIONS.stats()
+                full = stats["full_handshakes"]
+                resumed = stats["resumed_handshakes"]
+                print(f"{connection_type}: {full} full handshakes in {stats['full_handshake_ms']} ms"
+                      f" ({stats['full_handshake_ms'] / max(full, 1):.3f} ms each),"
+                      f" {resumed} resumed in {stats['resumed_handshake_ms']} ms"
+                      f" ({stats['resumed_handshake_ms'] / max(resumed, 1):.3f} ms each)")
+        tls_server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TLS session resumption benchmark.")
+    parser.add_argument('--clients', type=int, default=200, help='Number of sequential client connections')
+    args = parser.parse_args()
+    asyncio.run(main(args.clients))
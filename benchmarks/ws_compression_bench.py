@@ -0,0 +1,105 @@
+"""Compare bytes on the wire and CPU time for SIP over WebSocket with and without permessage-deflate.
+
+A local websockets server stands in for Kamailio and answers every message, and a counting
+TCP relay between the client and the server measures what would actually cross the network.
+
+    python3 benchmarks/ws_compression_bench.py --calls 500
+"""
+import asyncio
+import argparse
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+from websockets.asyncio.server import serve
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sip_client import SIPClient  # noqa: E402
+
+
+async def stand_in(websocket):
+    """Answer each request with a 200 OK carrying its headers back, like a proxy would."""
+    async for message in websocket:
+        head = message.split("\r\n\r\n", 1)[0]
+        await websocket.send("SIP/2.0 200 OK\r\n" + head.split("\r\n", 1)[1] + "\r\n\r\n")
+
+
+class Relay:
+    """TCP relay that counts the bytes it forwards in each direction."""
+
+    def __init__(self, target_port):
+        self.target_port = target_port
+        self.upstream = 0
+        self.downstream = 0
+        self.reads = 0
+
+    async def pipe(self, reader, writer, upstream):
+        while data := await reader.read(65536):
+            if upstream:
+                self.upstream += len(data)
+                self.reads += 1
+            else:
+                self.downstream += len(data)
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    async def handle(self, reader, writer):
+        target_reader, target_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        await asyncio.gather(self.pipe(reader, target_writer, True), self.pipe(target_reader, writer, False),
+                             return_exceptions=True)
+
+
+async def run(calls, compression, context_takeover, coalesce):
+    server_compression = None if compression == "none" else "deflate"
+    async with serve(stand_in, "127.0.0.1", 0, subprotocols=["sip"], compression=server_compression) as server:
+        server_port = server.sockets[0].getsockname()[1]
+        relay = Relay(server_port)
+        relay_server = await asyncio.start_server(relay.handle, "127.0.0.1", 0)
+        relay_port = relay_server.sockets[0].getsockname()[1]
+
+        client = SIPClient("127.0.0.1", port=relay_port, me="1100", connection_type="ws",
+                           ws_compression=compression, ws_context_takeover=context_takeover, coalesce=coalesce)
+        started_cpu = time.process_time()
+        started = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            await client.create_socket()
+            for _ in range(calls):
+                client.generate_call_id()
+                await client.register()
+                await client.invite_call("1200")
+                await client.receive_message()
+                await client.receive_message()
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - started_cpu
+
+        await client.websocket.close()
+        relay_server.close()
+        return relay, elapsed, cpu
+
+
+async def main(calls):
+    cases = [
+        ("none", True, False),
+        ("deflate", False, False),
+        ("deflate", True, False),
+        ("deflate", True, True),
+    ]
+    print(f"{calls} REGISTER + INVITE exchanges per run")
+    print(f"{'compression':<12}{'takeover':<10}{'coalesce':<10}{'up bytes':>10}{'down bytes':>12}"
+          f"{'reads':>8}{'B/msg':>8}{'cpu ms':>9}{'wall ms':>9}")
+    for compression, context_takeover, coalesce in cases:
+        relay, elapsed, cpu = await run(calls, compression, context_takeover, coalesce)
+        per_message = relay.upstream / (calls * 2)
+        print(f"{compression:<12}{str(context_takeover):<10}{str(coalesce):<10}{relay.upstream:>10}"
+              f"{relay.downstream:>12}{relay.reads:>8}{per_message:>8.1f}{cpu * 1000:>9.1f}{elapsed * 1000:>9.1f}")
+    # CPU time covers the client, the stand-in and the relay, which all share this process.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket compression benchmark.")
+    parser.add_argument('--calls', type=int, default=500, help='Number of REGISTER + INVITE exchanges per run')
+    args = parser.parse_args()
+    asyncio.run(main(args.calls))
@@ -0,0 +1,225 @@
+"""Per-call detail records (CDRs) and reconciliation against Kamailio's acc table.
+
+Every call() produces one CDR per side. A CDRWriter keeps them in memory and a background
+task appends them to a CSV or JSONL file in batches, rotating it by size, so disk writes never
+stall the event loop. The reconcile command compares those CDRs with an acc export:
+
+    python3 sip_cdr.py reconcile cdrs.jsonl acc.csv
+"""
+import asyncio
+import argparse
+import csv
+import json
+import os
+from datetime import datetime
+
+CDR_FIELDS = ("call_id", "side", "caller", "callee", "from_tag", "to_tag",
+              "setup", "answer", "end", "final_code", "bye_by")
+
+
+class CDR:
+    """One call as seen by one user agent; timestamps are Unix times in seconds."""
+    __slots__ = CDR_FIELDS
+
+    def __init__(self, call_id, side, caller, callee, setup, from_tag=None, to_tag=None):
+        self.call_id = call_id
+        self.side = side  # "caller" or "callee": which user agent wrote this record
+        self.caller = caller
+        self.callee = callee
+        self.from_tag = from_tag
+        self.to_tag = to_tag
+        self.setup = setup
+        self.answer = None
+        self.end = None
+        self.final_code = None
+        self.bye_by = None  # "caller" or "callee", None when the call never connected
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in CDR_FIELDS}
+
+
+class CDRWriter:
+    """Collects CDRs in memory and appends them to disk in batches from a background task.
+
+    A batch goes out when batch_size records are waiting or every flush_interval seconds. The
+    file write itself runs in the default executor. Once the file passes max_bytes it is rotated
+    to path.1 ... path.<backups>, like logging.handlers.RotatingFileHandler.
+
+    A batch that fails to write (disk full, bad path) is reported and retried with the next one.
+    At most max_pending records wait in memory; later ones are counted in dropped instead.
+    """
+
+    def __init__(self, path, fmt=None, batch_size=500, flush_interval=1.0, max_bytes=64 * 2 ** 20, backups=5,
+                 max_pending=100000):
+        self.path = path
+        self.fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_pending = max_pending
+        self.pending = []
+        self.written = 0
+        self.dropped = 0
+        self._wake = None
+        self._task = None
+        self._closing = False
+
+    def add(self, cdr):
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+        else:
+            self.pending.append(cdr)
+        if self._task is None or self._task.done():
+            if self._task is not None and not self._task.cancelled() and self._task.exception() is not None:
+                print(f"CDR writer stopped with {self._task.exception()!r}, restarting it")
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        if len(self.pending) >= self.batch_size:
+            self._wake.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            batch, self.pending = self.pending, []
+            if batch:
+                try:
+                    await loop.run_in_executor(None, self.write_batch, batch)
+                except OSError as e:
+                    print(f"Writing {len(batch)} CDRs to {self.path} failed: {e}")
+                    if self._closing:
+                        self.dropped += len(batch) + len(self.pending)
+                        self.pending = []
+                        return
+                    # Retry with the next batch, keeping the oldest records within the bound
+                    self.pending = batch + self.pending
+                    self.dropped += max(0, len(self.pending) - self.max_pending)
+                    del self.pending[self.max_pending:]
+                    await asyncio.sleep(self.flush_interval)  # Don't hammer a full disk on every add()
+                else:
+                    self.written += len(batch)
+            if self._closing and not self.pending:
+                return
+
+    async def close(self):
+        """Write whatever is still pending and stop the background task."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        self._closing = False
+
+    def write_batch(self, batch):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self.rotate()
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            if self.fmt == "csv":
+                writer = csv.DictWriter(f, fieldnames=CDR_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(cdr.as_dict() for cdr in batch)
+            else:
+                f.write("".join(json.dumps(cdr.as_dict()) + "\n" for cdr in batch))
+
+    def rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+def read_cdrs(path):
+    """Load CDRs written by CDRWriter (CSV or JSONL) as dicts."""
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+            for row in rows:
+                for field in CDR_FIELDS:
+                    row[field] = row[field] or None  # csv writes None as an empty string
+                for field in ("setup", "answer", "end"):
+                    row[field] = float(row[field]) if row[field] else None
+                row["final_code"] = int(row["final_code"]) if row["final_code"] else None
+            return rows
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def read_acc(path):
+    """Load an acc table export (CSV with a header row, e.g. from mysql or kamcli)."""
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def acc_time(value):
+    """acc.time is a DATETIME in the database; exports may also carry a Unix timestamp."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def reconcile(cdrs, acc_rows, tolerance=2.0):
+    """Compare CDRs with acc rows by Call-ID; returns a list of (call_id, problem) tuples.
+
+    acc writes an INVITE row when the call is answered (or a failed-transaction row with the
+    final code) and a BYE row when it ends, with src_user/dst_ouser from log_extra/db_extra.
+    """
+    acc_by_call = {}
+    for row in acc_rows:
+        acc_by_call.setdefault(row["callid"], {}).setdefault(row["method"].upper(), row)
+
+    problems = []
+    calls = {}
+    for cdr in cdrs:
+        # Prefer the caller's record when both sides of a call are in the file
+        if cdr["call_id"] not in calls or cdr["side"] == "caller":
+            calls[cdr["call_id"]] = cdr
+
+    for call_id, cdr in calls.items():
+        rows = acc_by_call.get(call_id)
+        if rows is None:
+            problems.append((call_id, "no acc record"))
+            continue
+        invite = rows.get("INVITE")
+        if invite is None:
+            problems.append((call_id, "no acc INVITE record"))
+        else:
+            if cdr["final_code"] is not None and int(invite["sip_code"]) != cdr["final_code"]:
+                problems.append((call_id, f"final code {cdr['final_code']} but acc has {invite['sip_code']}"))
+            if invite.get("src_user") and invite["src_user"] != cdr["caller"]:
+                problems.append((call_id, f"caller {cdr['caller']} but acc src_user {invite['src_user']}"))
+            if invite.get("dst_ouser") and invite["dst_ouser"] != cdr["callee"]:
+                problems.append((call_id, f"callee {cdr['callee']} but acc dst_ouser {invite['dst_ouser']}"))
+            reference = cdr["answer"] or cdr["end"]
+            if reference is not None and abs(acc_time(invite["time"]) - reference) > tolerance:
+                problems.append((call_id, f"acc INVITE time off by {acc_time(invite['time']) - reference:+.1f} s"))
+        if cdr["bye_by"] is not None and "BYE" not in rows:
+            problems.append((call_id, "call ended but no acc BYE record"))
+
+    for call_id in acc_by_call.keys() - calls.keys():
+        problems.append((call_id, "acc record without a CDR"))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CDR tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = commands.add_parser("reconcile", help="Compare client CDRs with an acc table export")
+    reconcile_parser.add_argument('cdrs', help='CDR file written by the client (.csv or .jsonl)')
+    reconcile_parser.add_argument('acc', help='acc table exported as CSV with a header row')
+    reconcile_parser.add_argument('--tolerance', type=float, default=2.0, help='Allowed clock skew in seconds')
+    args = parser.parse_args()
+
+    CDRS = read_cdrs(args.cdrs)
+    PROBLEMS = reconcile(CDRS, read_acc(args.acc), args.tolerance)
+    for CALL_ID, PROBLEM in PROBLEMS:
+        print(f"{CALL_ID}: {PROBLEM}")
+    print(f"{len({cdr['call_id'] for cdr in CDRS})} calls, {len(PROBLEMS)} discrepancies")
+    raise SystemExit(1 if PROBLEMS else 0)
@@ -1,26 +1,46 @@
 import asyncio
-import websockets
-from random import choices, randint
+import sys
+from contextlib import contextmanager
+from random import choices, randint, uniform
 from string import ascii_letters, digits
-from re import findall, search, DOTALL
+from re import findall, search, escape, DOTALL, compile as re_compile
 import socket
+import errno
+from functools import lru_cache
 import argparse
+from time import monotonic, time
 
+from sip_cdr import CDR, CDRWriter
 
+# kamailio.cfg pings idle WebSockets every 30 s and drops them after 60 s, so stay just under its interval
+KEEPALIVE_INTERVAL = 25
+PONG_TIMEOUT = 10  # RFC 5626 section 4.4.1: a flow without a pong within 10 s has failed
+DEFAULT_PORTS = {"ws": "80", "wss": "443", "tls": "5061"}  # Any other transport uses 5060
+
+
+def connection_errors():
+    """Exceptions that mean a connection was lost, including websockets' once it has been loaded."""
+    websockets = sys.modules.get("websockets")
+    if websockets is None:
+        return (OSError,)
+    return OSError, websockets.ConnectionClosed, websockets.InvalidHandshake
+
+
+@lru_cache(maxsize=None)
 def get_local_ip():
-    """Get the local IP address of the machine (may not be necessary for WebSocket)."""
+    """Get the local IP address of the machine, probed once per process (may not be necessary for WebSocket)."""
     try:
-        # Create a temporary socket and connect to a public IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))  # Google's public DNS, just to get the local IP used
-        local_ip = s.getsockname()[0]
-    except Exception as e:
+        # Create a temporary socket and connect to a public IP; nothing is sent for UDP
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))  # Google's public DNS, just to get the local IP used
+            return s.getsockname()[0]
+    except OSError as e:
         print(f"Error getting local IP: {e}")
-        local_ip = "127.0.0.1"  # Default to localhost if there's an issue
-    finally:
-        s.close()
-
-    return local_ip
+    try:
+        # Offline: fall back to whatever the host name resolves to
+        return socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return "127.0.0.1"  # Default to localhost if there's an issue
 
 def generate_branch():
     """Generate a unique branch parameter for the Via header."""
@@ -30,9 +50,118 @@ def generate_cseq():
     """Generate a random tag for the From/To headers."""
     return str(randint(1, 9999))
 
+def ws_extensions(compression="deflate", window_bits=15, context_takeover=True):
+    """Build the permessage-deflate offer (RFC 7692) for the WebSocket handshake."""
+    if compression is None or compression == "none":
+        return []
+    if compression != "deflate":
+        raise ValueError(f"Unsupported WebSocket compression: {compression}")
+    from websockets.extensions import permessage_deflate  # Only loaded by ws/wss clients
+    # SIP headers repeat from one message to the next, so keeping the LZ77 window
+    # between messages (context takeover) is where most of the saving comes from.
+    return [
+        permessage_deflate.ClientPerMessageDeflateFactory(
+            server_no_context_takeover=not context_takeover,
+            client_no_context_takeover=not context_takeover,
+            server_max_window_bits=window_bits,
+            client_max_window_bits=window_bits,
+        )
+    ]
+
+@contextmanager
+def corked(sock):
+    """Hold back partial TCP segments so back-to-back writes leave in as few packets as possible."""
+    cork = getattr(socket, "TCP_CORK", None)
+    if sock is None or cork is None:
+        yield
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, cork, 1)
+    try:
+        yield
+    finally:
+        sock.setsockopt(socket.IPPROTO_TCP, cork, 0)
+
+
+# Header names and their RFC 3261 section 7.3.3 (and later RFC) compact forms
+COMPACT_FORMS = {
+    "i": "Call-ID", "m": "Contact", "e": "Content-Encoding", "l": "Content-Length", "c": "Content-Type",
+    "f": "From", "s": "Subject", "k": "Supported", "t": "To", "v": "Via", "o": "Event", "u": "Allow-Events",
+    "r": "Refer-To", "b": "Referred-By", "x": "Session-Expires",
+}
+LONG_FORMS = {name: short for short, name in COMPACT_FORMS.items()}
+CANONICAL_NAMES = {name.lower(): name for name in (*LONG_FORMS, "CSeq", "Record-Route", "Route", "Max-Forwards",
+                                                   "Expires", "Allow", "Require", "Subscription-State",
+                                                   "Accept", "SIP-ETag", "SIP-If-Match")}
+CANONICAL_NAMES.update(COMPACT_FORMS)
+# Headers whose comma-joined values are split into one header line per value
+MULTI_VALUE_HEADERS = {"Via", "Route", "Record-Route", "Contact"}
+_KNOWN_NAMES = "|".join(escape(name) for name in sorted(CANONICAL_NAMES.values(), key=len, reverse=True))
+# Anything normalize_message would change: a folded line, a compact name, a comma-joined
+# multi-value header, or a known name written in another case or with space before the colon
+NEEDS_NORMALIZING = re_compile(
+    r"\r\n(?:[ \t]|[A-Za-z][ \t]*:|(?:Via|Route|Record-Route|Contact):[^\r\n]*,"
+    rf"|(?!(?:{_KNOWN_NAMES}):)(?i:{_KNOWN_NAMES})[ \t]*:)"
+)
+# Body length of a message read from a stream transport, searched in its raw header bytes
+CONTENT_LENGTH = re_compile(rb"\r\n(?i:content-length|l)[ \t]*:[ \t]*(\d+)")
+
+
+def split_header_values(value):
+    """Split a comma-joined header value, ignoring commas inside quotes or <...>."""
+    values = []
+    start = 0
+    quoted = False
+    bracketed = False
+    for index, char in enumerate(value):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "<>":
+            bracketed = char == "<"
+        elif char == "," and not quoted and not bracketed:
+            values.append(value[start:index].strip())
+            start = index + 1
+    values.append(value[start:].strip())
+    return [v for v in values if v]
+
+
+def normalize_message(message):
+    """Rewrite compact, folded and comma-joined headers as one long-form header per value.
+
+    The extractors below only know long header names, so every received message goes through here first.
+    """
+    end = message.find("\r\n\r\n")
+    if not NEEDS_NORMALIZING.search(message, 0, len(message) if end < 0 else end + 2):
+        return message  # Already long-form, one value per line: the common case
+    head, separator, body = message.partition("\r\n\r\n")
+    lines = head.split("\r\n")
+    unfolded = lines[:1]
+    for line in lines[1:]:
+        if line[:1] in (" ", "\t") and len(unfolded) > 1:
+            unfolded[-1] += " " + line.strip()  # Continuation of the previous header
+        else:
+            unfolded.append(line)
+
+    headers = unfolded[:1]
+    for line in unfolded[1:]:
+        name, colon, value = line.partition(":")
+        if not colon:
+            headers.append(line)
+            continue
+        name = CANONICAL_NAMES.get(name.strip().lower(), name.strip())
+        value = value.strip()
+        if name in MULTI_VALUE_HEADERS and "," in value:
+            headers.extend(f"{name}: {v}" for v in split_header_values(value))
+        else:
+            headers.append(f"{name}: {value}")
+    return "\r\n".join(headers) + separator + body
+
 
 # Headers
 class SIPHeaders:
+    @staticmethod
+    def header_name(name, compact=False) -> str:
+        return LONG_FORMS.get(name, name) if compact else name
+
     @staticmethod
     def sip_uri(host, number=None, port=None) -> str:
         if port is None and number is None:
@@ -43,48 +172,323 @@ class SIPHeaders:
             return f"sip:{number}@{host}:{port}"
 
     @staticmethod
-    def contact_header(uri, transport=None) -> str:
-        return f"Contact: <{uri};transport:{transport}>\r\n"
+    def contact_header(uri, transport=None, compact=False) -> str:
+        return f"{SIPHeaders.header_name('Contact', compact)}: <{uri};transport:{transport}>\r\n"
 
     @staticmethod
     def cseq_header(sequence, method) -> str:
         return f"CSeq: {sequence} {method}\r\n"
 
     @staticmethod
-    def call_id_header(call_id) -> str:
-        return f"Call-ID: {call_id}\r\n"
+    def call_id_header(call_id, compact=False) -> str:
+        return f"{SIPHeaders.header_name('Call-ID', compact)}: {call_id}\r\n"
 
     @staticmethod
-    def to_header(uri, to_tag=None) -> str:
-        header = f"To: <{uri}>"
+    def to_header(uri, to_tag=None, compact=False) -> str:
+        header = f"{SIPHeaders.header_name('To', compact)}: <{uri}>"
         if to_tag is None:
             return f"{header}\r\n"
         return f"{header};tag={to_tag}\r\n"
 
     @staticmethod
-    def from_header(uri, from_tag) -> str:
-        return f"From: <{uri}>;tag={from_tag}\r\n"
+    def from_header(uri, from_tag, compact=False) -> str:
+        return f"{SIPHeaders.header_name('From', compact)}: <{uri}>;tag={from_tag}\r\n"
+
+    @staticmethod
+    def via_header(address, branch, protocol, compact=False) -> str:
+        return f'{SIPHeaders.header_name("Via", compact)}: SIP/2.0/{protocol.upper()} {address};rport;branch={branch}\r\n'
+
+    @staticmethod
+    def content_type_header(content_type, compact=False) -> str:
+        return f"{SIPHeaders.header_name('Content-Type', compact)}: {content_type}\r\n"
 
     @staticmethod
-    def via_header(address, branch, protocol) -> str:
-        return f'Via: SIP/2.0/{protocol.upper()} {address};rport;branch={branch}\r\n'
+    def content_length_header(length, compact=False) -> str:
+        return f"{SIPHeaders.header_name('Content-Length', compact)}: {length}\r\n"
+
+
+def parse_port_range(ports):
+    """Turn '20000-29999' (or a single port) into a range for LocalAddressPool."""
+    low, _, high = ports.partition("-")
+    return range(int(low), int(high or low) + 1)
+
+
+class LocalAddressPool:
+    """Spreads client sockets across several source IPs (or aliases) and an explicit port range.
+
+    Each (ip, port) pair is lent to one client at a time, so tens of thousands of connections are
+    not limited by the ephemeral port range of a single address. Without a port range the kernel
+    picks the port and only the source IPs are rotated.
+    """
+
+    def __init__(self, addresses=None, ports=None):
+        self.addresses = list(addresses or [get_local_ip()])
+        self.ports = ports
+        self.in_use = set()
+        self._next = 0
+
+    def acquire(self):
+        if self.ports is None:
+            address = self.addresses[self._next % len(self.addresses)]
+            self._next += 1
+            return address, 0
+        # Walk the addresses first so consecutive clients land on different source IPs
+        total = len(self.addresses) * len(self.ports)
+        for _ in range(total):
+            index = self._next
+            self._next = (index + 1) % total
+            binding = (self.addresses[index % len(self.addresses)], self.ports[index // len(self.addresses)])
+            if binding not in self.in_use:
+                self.in_use.add(binding)
+                return binding
+        raise OSError(errno.EADDRNOTAVAIL, "Local address pool exhausted")
+
+    def release(self, binding):
+        self.in_use.discard(binding)
+
+
+class ReconnectThrottle:
+    """Process-wide cap on simultaneous reconnects, with jittered exponential backoff between attempts.
+
+    After a proxy restart every user agent loses its flow at once; the jitter spreads their
+    reconnects out and the semaphore bounds how many handshakes are in flight.
+    """
+
+    def __init__(self, concurrency=100, base_delay=0.5, max_delay=30.0):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.reconnects = 0
+        self.failures = 0
+
+    def backoff(self, attempt):
+        """Full jitter: anywhere between zero and the capped exponential delay."""
+        return uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def reconnect(self, client):
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.backoff(attempt))
+            async with self.semaphore:
+                try:
+                    await client.create_socket()
+                    self.reconnects += 1
+                    return
+                except (asyncio.TimeoutError, *connection_errors()) as e:
+                    self.failures += 1
+                    print(f"Reconnect attempt {attempt + 1} to {client.uri}:{client.port} failed: {e}")
+            attempt += 1
+
+
+RECONNECTS = ReconnectThrottle()
+
+
+class Dialog:
+    """The state needed to send in-dialog requests, pulled out of the INVITE or 200 OK once."""
+    __slots__ = ("call_id", "local_tag", "remote_tag", "cseq", "remote_target", "route_set", "expires")
+
+    def __init__(self, call_id, local_tag, remote_tag, cseq, remote_target, route_set, expires):
+        self.call_id = call_id
+        self.local_tag = local_tag
+        self.remote_tag = remote_tag
+        self.cseq = cseq
+        self.remote_target = remote_target
+        self.route_set = route_set
+        self.expires = expires
+
+
+class DialogStore:
+    """Process-wide dialogs keyed by (Call-ID, local tag), with expiry buckets so stale ones are reaped in bulk.
+
+    The local tag is part of the key (RFC 3261 section 12) because both ends of a call can live in
+    one process, e.g. the daemon or sip_loopback, and each needs its own record. Route sets are
+    shared between dialogs, since calls through the same proxies carry identical ones.
+    """
+
+    def __init__(self, ttl=7200, bucket=10):
+        self.ttl = ttl
+        self.bucket = bucket
+        self.dialogs = {}
+        self.buckets = {}  # Bucket number -> {(Call-ID, local tag): None}, an insertion-ordered set
+        self.route_sets = {}
+
+    def __len__(self):
+        return len(self.dialogs)
+
+    def add(self, call_id, local_tag, remote_tag, cseq, remote_target, route_set, now=None):
+        route_set = tuple(route_set)
+        route_set = self.route_sets.setdefault(route_set, route_set)
+        expires = (monotonic() if now is None else now) + self.ttl
+        self.remove(call_id, local_tag)  # A re-INVITE'd dialog moves to its new bucket
+        dialog = Dialog(call_id, local_tag, remote_tag, cseq, remote_target, route_set, expires)
+        dialog_id = (call_id, local_tag)  # One key tuple shared by both indexes
+        self.dialogs[dialog_id] = dialog
+        self.buckets.setdefault(int(expires // self.bucket), {})[dialog_id] = None
+        return dialog
+
+    def get(self, call_id, local_tag):
+        return self.dialogs.get((call_id, local_tag))
+
+    def remove(self, call_id, local_tag):
+        dialog = self.dialogs.pop((call_id, local_tag), None)
+        if dialog is not None:
+            key = int(dialog.expires // self.bucket)
+            bucket = self.buckets[key]
+            del bucket[call_id, local_tag]
+            if not bucket:
+                del self.buckets[key]
+        return dialog
+
+    def reap(self, now=None):
+        """Drop every dialog that expired before now; returns how many were removed."""
+        now = monotonic() if now is None else now
+        reaped = 0
+        for key in [key for key in self.buckets if (key + 1) * self.bucket <= now]:
+            for dialog_id in self.buckets.pop(key):
+                del self.dialogs[dialog_id]
+                reaped += 1
+        return reaped
+
+
+DIALOGS = DialogStore()
+
+
+class DatagramFlow(asyncio.DatagramProtocol):
+    """A connected UDP socket to the proxy: each SIP message is one datagram (RFC 3261 section 18.1.1).
+
+    Offers the same send()/recv() as sip_loopback's MemoryTransport. ICMP errors such as port
+    unreachable come out of recv() as the OSError they were reported with.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.inbox = asyncio.Queue()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.inbox.put_nowait(data.decode('utf-8'))
+
+    def error_received(self, exc):
+        self.inbox.put_nowait(exc)
+
+    def send(self, message):
+        self.transport.sendto(message.encode('utf-8'))
+
+    async def recv(self):
+        message = await self.inbox.get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+
+class StreamFlow(asyncio.Protocol):
+    """A TCP or TLS connection to the proxy, split into SIP messages by Content-Length (RFC 3261 section 18.3).
+
+    Offers the same send()/recv() as DatagramFlow. The event loop reads the connection as data
+    arrives, whether or not anyone is waiting in recv(), so RFC 5626 CRLF pongs on an idle flow
+    still move last_pong, and a burst that arrives in one read is handed out one message per recv().
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.inbox = asyncio.Queue()
+        self.buffer = b""  # Bytes past the last complete message
+        self.last_pong = 0.0
+        self.closed = asyncio.Event()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        while (message := self.next_message()) is not None:
+            self.inbox.put_nowait(message)
+
+    def connection_lost(self, exc):
+        self.closed.set()
+        self.inbox.put_nowait(exc or ConnectionError("Connection closed by peer"))
+
+    def next_message(self):
+        """Take the first complete message off the buffer, or return None if it is still partial."""
+        buffer = self.buffer.lstrip(b"\r\n")
+        if len(buffer) < len(self.buffer):
+            self.last_pong = monotonic()
+            self.buffer = buffer
+        end = buffer.find(b"\r\n\r\n")
+        if end < 0:
+            return None
+        length = CONTENT_LENGTH.search(buffer, 0, end)
+        total = end + 4 + (int(length.group(1)) if length else 0)
+        if len(buffer) < total:
+            return None
+        self.buffer = buffer[total:]
+        return buffer[:total].decode('utf-8')
+
+    def send(self, message):
+        self.transport.write(message.encode('utf-8'))
+
+    async def recv(self):
+        message = await self.inbox.get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def wait_closed(self, timeout):
+        """Wait up to timeout seconds for the connection to go away; returns True if it did."""
+        try:
+            await asyncio.wait_for(self.closed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
 
 class SIPClient:
-    def __init__(self, uri, port="80", me="1100", connection_type="ws"):
+    def __init__(self, uri, port="80", me="1100", connection_type="ws",
+                 ws_compression="deflate", ws_window_bits=15, ws_context_takeover=True, coalesce=False,
+                 tls_verify=True, tls_cafile=None, keepalive_interval=KEEPALIVE_INTERVAL, address_pool=None,
+                 compact_headers=False, cdr_writer=None):
         self.uri = uri
         self.port = int(port)  # Port should be an integer for socket
         self.me = me
         self.connection_type = connection_type.lower()
 
         self.websocket = None
-        self.socket = None
+        self.stream = None  # StreamFlow for connection_type "tcp" and "tls"
+
+        if ws_compression not in (None, "none", "deflate"):
+            raise ValueError(f"Unsupported WebSocket compression: {ws_compression}")
+        self.ws_compression = (ws_compression, ws_window_bits, ws_context_takeover)  # Offer built on connect
+        self.coalesce = coalesce  # Batch messages queued in the same event-loop tick into one write
+        self._pending = []
+        self._flush_task = None
+
+        self.tls_verify = tls_verify
+        self.tls_cafile = tls_cafile
+        self.ssl_object = None  # Set for wss/tls so the session can be kept once its ticket arrives
+
+        self.keepalive_interval = keepalive_interval  # None disables keepalives
+        self.connected = False
+        self.closing = False
+        self.registered = False
+        self._keepalive_task = None
+        self._reconnect_task = None
 
         self.call_id = None
+        # RFC 3261 section 10.2: every REGISTER (refresh or re-REGISTER) reuses one Call-ID with a rising CSeq
+        self.register_call_id = None
+        self.register_cseq = 0
         self.branch = generate_branch()
         self.tag = ''.join(choices(ascii_letters + digits, k=10))
 
-        self.local_ip = get_local_ip()  # Get the local IP address
+        self.compact_headers = compact_headers  # Emit v/f/t/i/m/c/l instead of the long header names
+        self.cdr_writer = cdr_writer  # sip_cdr.CDRWriter collecting one record per call
+        self.memory = None  # MemoryTransport end for connection_type "memory" (see sip_loopback.py)
+        self.datagram = None  # DatagramFlow for connection_type "udp"
+        self.address_pool = address_pool  # Shared LocalAddressPool, or None to let the kernel choose
+        self.binding = None
+        self.local_ip = get_local_ip()  # Replaced by the address actually bound once connected
         self.local_port = None  # Set the local port (could be dynamically assigned)
 
     def get_address(self):
@@ -92,61 +496,288 @@ class SIPClient:
             return f"{self.local_ip}"
         return f"{self.local_ip}:{self.local_port}"
 
+    def connection(self):
+        """The websocket, stream or datagram flow, or memory transport in use; None while disconnected."""
+        if self.connection_type in ("ws", "wss"):
+            return self.websocket
+        if self.connection_type == "memory":
+            return self.memory
+        if self.connection_type == "udp":
+            return self.datagram
+        return self.stream
+
     def generate_call_id(self):
         """Generate a random Call-ID for the SIP session."""
         self.call_id = ''.join(choices(ascii_letters + digits, k=20))
 
     async def create_socket(self):
         """Establish connection based on the connection type."""
-        if self.connection_type == "ws":
-            self.websocket = await websockets.connect(f"ws://{self.uri}", subprotocols=["sip"])
+        if self.connection_type in ("ws", "wss"):
+            import websockets  # Only loaded by ws/wss clients, so the others start faster
+            context = None
+            if self.connection_type == "wss":
+                from sip_tls import TLS_SESSIONS
+                context = TLS_SESSIONS.context(self.uri, self.port, self.tls_verify, self.tls_cafile)
+            # Extensions are passed explicitly so the offer matches the configured deflate settings
+            # WS keepalives use ping/pong frames, handled by websockets itself
+            sock = await self.open_socket()
+            self.websocket = await websockets.connect(f"{self.connection_type}://{self.uri}:{self.port}",
+                                                      sock=sock, subprotocols=["sip"], ssl=context,
+                                                      extensions=ws_extensions(*self.ws_compression), compression=None,
+                                                      ping_interval=self.keepalive_interval,
+                                                      ping_timeout=PONG_TIMEOUT)
+            if context is not None:
+                self.ssl_object = self.websocket.transport.get_extra_info("ssl_object")
+        elif self.connection_type == "memory":
+            if self.memory is None:
+                raise ConnectionError("No in-memory transport attached to this client")
+            self.local_ip, self.local_port = self.memory.address
+        elif self.connection_type == "udp":
+            self.binding = self.address_pool.acquire() if self.address_pool is not None else None
+            _, self.datagram = await asyncio.get_running_loop().create_datagram_endpoint(
+                DatagramFlow, local_addr=self.binding, remote_addr=(self.uri, self.port))
+            self.local_ip, self.local_port = self.datagram.transport.get_extra_info("sockname")[:2]
         else:
-            loop = asyncio.get_running_loop()
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            await loop.run_in_executor(None, self.socket.connect, (self.uri, self.port))
-            self.local_port = self.socket.getsockname()[1]
+            context = None
+            if self.connection_type == "tls":
+                # Offers the shared session for resumption; sip_tls times the handshake
+                from sip_tls import TLS_SESSIONS
+                context = TLS_SESSIONS.context(self.uri, self.port, self.tls_verify, self.tls_cafile)
+            sock = await self.open_socket()
+            _, self.stream = await asyncio.get_running_loop().create_connection(
+                StreamFlow, sock=sock, ssl=context, server_hostname=self.uri if context else None)
+            if context is not None:
+                self.ssl_object = self.stream.transport.get_extra_info("ssl_object")
             print(f"Connected to {self.uri}:{self.port} from local port {self.local_port}\n")
+        self.connected = True
+
+    async def connect(self):
+        """Open the connection unless it is already up, and keep it alive until close()."""
+        if self._reconnect_task is not None:
+            await self._reconnect_task
+        if self.connected:
+            return
+        self.closing = False
+        await self.create_socket()
+        self.start_keepalive()
+
+    async def close(self):
+        """Stop keepalives and any reconnect in progress, and close the connection for good."""
+        self.closing = True
+        self.stop_keepalive()
+        task = self._reconnect_task
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.drop_connection()
+
+    async def drop_connection(self):
+        self.connected = False
+        if self.binding is not None:
+            self.address_pool.release(self.binding)
+            self.binding = None
+        if self.websocket is not None:
+            await self.websocket.close()
+            self.websocket = None
+        if self.datagram is not None:
+            self.datagram.transport.close()
+            self.datagram = None
+        if self.stream is not None:
+            self.stream.transport.close()
+            self.stream = None
+
+    def start_keepalive(self):
+        # UDP flows would need STUN keepalives (RFC 5626 section 4.4.2), which are not implemented
+        if self.keepalive_interval and self._keepalive_task is None and self.connection_type not in ("memory", "udp"):
+            self._keepalive_task = asyncio.get_running_loop().create_task(self.keepalive())
+
+    def stop_keepalive(self):
+        task, self._keepalive_task = self._keepalive_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    async def keepalive(self):
+        """Watch the flow and reconnect when it fails.
+
+        WebSockets are pinged by websockets itself and close when a pong is missed. TCP and TLS
+        flows get the RFC 5626 double-CRLF ping, jittered to 80-100% of the interval, and fail when
+        StreamFlow has not seen a CRLF pong within PONG_TIMEOUT. StreamFlow reads pongs even while
+        no call is using the connection, so an idle flow that died silently is caught too, and a
+        closed one is noticed right away.
+        """
+        if self.connection_type in ("ws", "wss"):
+            await self.websocket.wait_closed()
+        else:
+            stream = self.stream
+            while True:
+                if await stream.wait_closed(self.keepalive_interval * uniform(0.8, 1.0)):
+                    print(f"Connection to {self.uri}:{self.port} closed")
+                    break
+                sent = monotonic()
+                stream.send("\r\n\r\n")
+                if await stream.wait_closed(PONG_TIMEOUT):
+                    print(f"Connection to {self.uri}:{self.port} closed")
+                    break
+                if stream.last_pong < sent:
+                    print(f"No keepalive pong from {self.uri}:{self.port} within {PONG_TIMEOUT} s")
+                    break
+        self._keepalive_task = None
+        if not self.closing:
+            self.reconnect()
+
+    def reconnect(self):
+        """Start re-establishing a lost flow, or return the reconnect already in progress."""
+        if self._reconnect_task is None:
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+        return self._reconnect_task
+
+    async def _reconnect(self):
+        try:
+            self.stop_keepalive()
+            await self.drop_connection()
+            await RECONNECTS.reconnect(self)
+            if self.closing:
+                # close() was called while the new connection was being opened
+                await self.drop_connection()
+                return
+            self.start_keepalive()
+            if self.registered:
+                # RFC 5626 flow recovery: the binding belonged to the old connection
+                await self.register()
+        finally:
+            self._reconnect_task = None
+
+    async def open_socket(self, attempts=8):
+        """Open a TCP connection to the proxy from the next free binding in the address pool."""
+        loop = asyncio.get_running_loop()
+        for _ in range(attempts):
+            binding = self.address_pool.acquire() if self.address_pool is not None else None
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                if binding is not None:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    sock.bind(binding)
+                sock.setblocking(False)
+                await loop.sock_connect(sock, (self.uri, self.port))
+            except OSError as e:
+                sock.close()
+                if binding is not None:
+                    self.address_pool.release(binding)
+                if binding is None or e.errno not in (errno.EADDRINUSE, errno.EADDRNOTAVAIL):
+                    raise
+                continue  # Port taken outside the pool (or still in TIME_WAIT), try the next one
+            self.binding = binding
+            # Via and Contact advertise the address this connection really uses
+            self.local_ip, self.local_port = sock.getsockname()[:2]
+            return sock
+        raise OSError(errno.EADDRINUSE, f"No free local binding after {attempts} attempts")
 
     async def send_message(self, message):
         """Send a SIP message based on the connection type."""
-        if self.connection_type == "ws":
-            await self.websocket.send(message)
+        if self.coalesce:
+            self._pending.append(message)
+            if self._flush_task is None:
+                self._flush_task = asyncio.get_running_loop().create_task(self.flush())
         else:
-            self.socket.sendall(message.encode('utf-8'))
+            await self.write_messages([message])
         print(f"Sent:\n{message}")
 
+    async def flush(self):
+        """Write every message queued by send_message since the last flush."""
+        try:
+            while self._pending:
+                pending, self._pending = self._pending, []
+                await self.write_messages(pending)
+        finally:
+            self._flush_task = None
+
+    async def write_messages(self, messages):
+        """Write a batch of SIP messages; each one stays a single WebSocket text frame (RFC 7118)."""
+        connection = self.connection()
+        if connection is None:
+            print("Connection lost while sending: dropped for a reconnect")
+            if not self.closing:
+                self.reconnect()
+            return
+        try:
+            if self.connection_type in ("ws", "wss"):
+                sock = connection.transport.get_extra_info("socket") if len(messages) > 1 else None
+                with corked(sock):
+                    for message in messages:
+                        await connection.send(message)
+            elif self.connection_type in ("memory", "udp"):
+                for message in messages:
+                    connection.send(message)
+            else:
+                connection.send("".join(messages))  # One write for the whole batch
+        except connection_errors() as e:
+            print(f"Connection lost while sending: {e}")
+            if not self.closing:
+                self.reconnect()
+
     async def receive_message(self):
         """Receive a SIP message based on the connection type."""
+        connection = self.connection()
         try:
-            if self.connection_type == "ws":
-                response = await asyncio.wait_for(self.websocket.recv(), timeout=30)
-                print(f"Received:\n{response}")
-            else:
-                response = await asyncio.get_running_loop().run_in_executor(None, self.socket.recv, 4096)
-                response = response.decode('utf-8')
-                print(f"Received:\n{response}")
-            return response
+            if connection is None:
+                raise ConnectionError("Dropped for a reconnect")
+            response = await asyncio.wait_for(connection.recv(), timeout=30)
         except asyncio.TimeoutError:
             print("No response received within the timeout period.")
             return None
+        except connection_errors() as e:
+            print(f"Connection lost: {e}")
+            if not self.closing:
+                await self.reconnect()
+            return None
+        print(f"Received:\n{response}")
+        response = normalize_message(response)
+        if self.ssl_object is not None:
+            # The first read has processed any TLS 1.3 session tickets, so the session is resumable now
+            from sip_tls import TLS_SESSIONS
+            TLS_SESSIONS.remember(self.ssl_object)
+            self.ssl_object = None
+        return response
 
     async def register(self):
-        cseq = generate_cseq()
-
         """Send SIP REGISTER message over WebSocket."""
+        if self.register_call_id is None:
+            self.register_call_id = ''.join(choices(ascii_letters + digits, k=20))
+            self.register_cseq = int(generate_cseq())
+        else:
+            self.register_cseq += 1
+        cseq = self.register_cseq
+
         sip_register = (
             f'REGISTER {SIPHeaders.sip_uri(self.uri)};transport:{self.connection_type} SIP/2.0\r\n'
-            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type)}'
+            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type, compact=self.compact_headers)}'
             'Max-Forwards: 70\r\n'
-            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag)}'
-            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=self.me))}'
-            f'{SIPHeaders.call_id_header(self.call_id)}'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=self.me), compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(self.register_call_id, compact=self.compact_headers)}'
             f'{SIPHeaders.cseq_header(cseq, "REGISTER")}'
-            f'{SIPHeaders.contact_header(SIPHeaders.sip_uri(self.local_ip, self.me, self.local_port), self.connection_type)}'
+            f'{SIPHeaders.contact_header(SIPHeaders.sip_uri(self.local_ip, self.me, self.local_port), self.connection_type, compact=self.compact_headers)}'
             'Expires: 3600\r\n'
-            'Content-Length: 0\r\n\r\n'
+            f'{SIPHeaders.content_length_header(0, self.compact_headers)}\r\n'
         )
         await self.send_message(sip_register)
+        self.registered = True
+
+    async def send_options(self, cseq, target=None):
+        """Send an out-of-dialog OPTIONS to the proxy (or target URI), the usual SIP health probe."""
+        sip_options = (
+            f'OPTIONS {target or SIPHeaders.sip_uri(self.uri)} SIP/2.0\r\n'
+            f'{SIPHeaders.via_header(self.get_address(), generate_branch(), self.connection_type, compact=self.compact_headers)}'
+            'Max-Forwards: 70\r\n'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.to_header(target or SIPHeaders.sip_uri(self.uri), compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(self.call_id, compact=self.compact_headers)}'
+            f'{SIPHeaders.cseq_header(cseq, "OPTIONS")}'
+            f'{SIPHeaders.contact_header(SIPHeaders.sip_uri(self.local_ip, self.me, self.local_port), self.connection_type, compact=self.compact_headers)}'
+            'Accept: application/sdp\r\n'
+            f'{SIPHeaders.content_length_header(0, self.compact_headers)}\r\n'
+        )
+        await self.send_message(sip_options)
 
     async def invite_call(self, callee):
         """Send SIP INVITE message."""
@@ -165,15 +796,15 @@ class SIPClient:
 
         sip_invite = (
             f'INVITE {SIPHeaders.sip_uri(self.uri, number=callee)} SIP/2.0\r\n'
-            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type)}'
+            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type, compact=self.compact_headers)}'
             'Max-Forwards: 70\r\n'
-            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag)}'
-            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=callee))}'
-            f'{SIPHeaders.call_id_header(self.call_id)}'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=callee), compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(self.call_id, compact=self.compact_headers)}'
             f'{SIPHeaders.cseq_header(cseq, "INVITE")}'
-            f'{SIPHeaders.contact_header(SIPHeaders.sip_uri(self.local_ip, self.me, self.local_port), self.connection_type)}'
-            "Content-Type: application/sdp\r\n"
-            f"Content-Length: {content_length}\r\n\r\n"
+            f'{SIPHeaders.contact_header(SIPHeaders.sip_uri(self.local_ip, self.me, self.local_port), self.connection_type, compact=self.compact_headers)}'
+            f'{SIPHeaders.content_type_header("application/sdp", self.compact_headers)}'
+            f'{SIPHeaders.content_length_header(content_length, self.compact_headers)}\r\n'
             f"{sdp_body}"
         )
         await self.send_message(sip_invite)
@@ -196,12 +827,12 @@ class SIPClient:
             f"SIP/2.0 180 Ringing\r\n"
             f"{via_headers_str}\r\n"  # Include all Via headers
             f"{routes_headers}\r\n"
-            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag)}'
-            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=caller), from_tag)}'
-            f'{SIPHeaders.call_id_header(self.call_id)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=caller), from_tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(self.call_id, compact=self.compact_headers)}'
             f'{SIPHeaders.cseq_header(cseq, "INVITE")}'
-            f"Contact: <sip:{req_line};ob> \r\n"
-            "Content-Length: 0\r\n\r\n"
+            f"{SIPHeaders.header_name('Contact', self.compact_headers)}: <sip:{req_line};ob> \r\n"
+            f'{SIPHeaders.content_length_header(0, self.compact_headers)}\r\n'
         )
         await self.send_message(sip_ringing)
 
@@ -258,13 +889,13 @@ class SIPClient:
             f"SIP/2.0 200 OK\r\n"
             f"{via_headers_str}\r\n"  # Include all Via headers
             f"{routes_headers}\r\n"
-            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag)}'
-            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=caller), from_tag)}'
-            f'{SIPHeaders.call_id_header(self.call_id)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=caller), from_tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(self.call_id, compact=self.compact_headers)}'
             f'{SIPHeaders.cseq_header(cseq, "INVITE")}'
-            f"Contact: <sip:{req_line};ob> \r\n"
-            "Content-Type: application/sdp\r\n"
-            f"Content-Length: {content_length}\r\n\r\n"
+            f"{SIPHeaders.header_name('Contact', self.compact_headers)}: <sip:{req_line};ob> \r\n"
+            f'{SIPHeaders.content_type_header("application/sdp", self.compact_headers)}'
+            f'{SIPHeaders.content_length_header(content_length, self.compact_headers)}\r\n'
             f"{sdp_response}"
         )
         await self.send_message(sip_200_ok)
@@ -281,47 +912,46 @@ class SIPClient:
 
         sip_ack = (
             f"ACK {contact} SIP/2.0\r\n"
-            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type)}'
-            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=callee), to_tag)}'
-            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag)}'
-            f'{SIPHeaders.call_id_header(self.call_id)}'
+            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type, compact=self.compact_headers)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=callee), to_tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(self.call_id, compact=self.compact_headers)}'
             f'{SIPHeaders.cseq_header(cseq, "ACK")}'
             f"{routes_headers}\r\n"
-            "Content-Length: 0\r\n\r\n"
+            f'{SIPHeaders.content_length_header(0, self.compact_headers)}\r\n'
         )
 
         await self.send_message(sip_ack)
 
-    async def send_bye(self, response, other):
-        contact = self.extract_contact(response)
-        route = self.extract_record_route(response)
+    def dialog_from_response(self, response):
+        """Record the dialog a 2xx to our INVITE created (UAC side, RFC 3261 section 12.1.2)."""
+        return DIALOGS.add(self.call_id, self.tag, self.extract_to_tag(response), int(self.extract_cseq(response)),
+                           self.extract_contact(response), reversed(self.extract_record_route(response)))
 
-        ok_from_tag = self.extract_from_tag(response)
-        ok_to_tag = self.extract_to_tag(response)
-        if self.tag == ok_from_tag:
-            other_tag = ok_to_tag
-        else:
-            other_tag = ok_from_tag
+    def dialog_from_request(self, request):
+        """Record the dialog our 2xx to an INVITE created (UAS side, RFC 3261 section 12.1.1)."""
+        return DIALOGS.add(self.call_id, self.tag, self.extract_from_tag(request), int(self.extract_cseq(request)),
+                           self.extract_contact(request), self.extract_record_route(request))
 
+    async def send_bye(self, dialog, other):
         self.branch = generate_branch()
+        dialog.cseq += 1
 
-        routes_headers = "\r\n".join([f"Route: <{route[i]}>" for i in range(len(route) - 1, -1, -1)])
-
-        cseq = self.extract_cseq(response)
-        cseq = str(int(cseq) + 1)
+        routes_headers = "".join(f"Route: <{route}>\r\n" for route in dialog.route_set)
 
         """Send SIP BYE message."""
         sip_bye = (
-            f"BYE {contact} SIP/2.0\r\n"
-            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type)}'
-            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=other), other_tag)}'
-            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), self.tag)}'
-            f'{SIPHeaders.call_id_header(self.call_id)}'
-            f'{SIPHeaders.cseq_header(cseq, "BYE")}'
-            f"{routes_headers}\r\n"
-            "Content-Length: 0\r\n\r\n"
+            f"BYE {dialog.remote_target} SIP/2.0\r\n"
+            f'{SIPHeaders.via_header(self.get_address(), self.branch, self.connection_type, compact=self.compact_headers)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=other), dialog.remote_tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=self.me), dialog.local_tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(dialog.call_id, compact=self.compact_headers)}'
+            f'{SIPHeaders.cseq_header(dialog.cseq, "BYE")}'
+            f"{routes_headers}"
+            f'{SIPHeaders.content_length_header(0, self.compact_headers)}\r\n'
         )
         await self.send_message(sip_bye)
+        DIALOGS.remove(dialog.call_id, dialog.local_tag)
 
     async def handle_bye(self, response, other):
         """Handle receiving SIP BYE message and send 200 OK for it."""
@@ -344,17 +974,33 @@ class SIPClient:
         sip_200_ok_bye = (
             f"SIP/2.0 200 OK\r\n"
             f"{via_headers_str}\r\n"  # Include all Via headers
-            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=to_number), to_tag)}'
-            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=from_number), from_tag)}'
-            f'{SIPHeaders.call_id_header(self.call_id)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(self.uri, number=to_number), to_tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(self.uri, number=from_number), from_tag, compact=self.compact_headers)}'
+            f'{SIPHeaders.call_id_header(self.call_id, compact=self.compact_headers)}'
             f'{SIPHeaders.cseq_header(cseq, "BYE")}'
-            "Content-Type: application/sdp\r\n"
-            f"Content-Length: 0\r\n\r\n"
+            f'{SIPHeaders.content_type_header("application/sdp", self.compact_headers)}'
+            f'{SIPHeaders.content_length_header(0, self.compact_headers)}\r\n'
 
         )
         await self.send_message(sip_200_ok_bye)
 
+    def record_cdr(self, cdr):
+        if self.cdr_writer is not None and cdr is not None:
+            self.cdr_writer.add(cdr)
+
     # Extract From SIP Message
+    @staticmethod
+    def is_invite_response(response):
+        return response.startswith("SIP/2.0 ") and search(r"CSeq:\s*\d+ INVITE", response) is not None
+
+    @staticmethod
+    def extract_final_invite_code(response):
+        """Return the status code of a final (>= 300) response to INVITE, or None."""
+        match = search(r"^SIP/2.0 ([3-6]\d\d)", response)
+        if match and SIPClient.is_invite_response(response):
+            return int(match.group(1))
+        return None
+
     @staticmethod
     def extract_sdp(response):
         """Extract the SDP body from the INVITE response."""
@@ -462,8 +1108,96 @@ class SIPClient:
             return None
 
 
+async def hold_call(hold, hangup=None):
+    """Keep a connected call up for `hold` seconds, or until `hangup` is set (forever if hold is None)."""
+    if hangup is None:
+        await asyncio.sleep(hold)
+        return
+    try:
+        await asyncio.wait_for(hangup.wait(), hold)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def place_call(client: SIPClient, callee, send_bye, hold=3, hangup=None, linger=3, receive=None):
+    """Send an INVITE on an open, registered client and run the caller side until the call ends.
+
+    receive returns the next message for the call, client.receive_message unless the connection
+    has a reader of its own (see sip_daemon.py).
+    """
+    receive = receive or client.receive_message
+    isCall = True
+    await client.invite_call(callee)
+    cdr = CDR(client.call_id, "caller", client.me, callee, setup=time(), from_tag=client.tag)
+    while isCall:
+        response = await receive()
+        # The CSeq check keeps a late REGISTER 200 OK from being taken for the answer
+        if response and "200 OK" in response and "Contact" in response and client.is_invite_response(response):
+            dialog = client.dialog_from_response(response)
+            cdr.answer, cdr.final_code, cdr.to_tag = time(), 200, dialog.remote_tag
+            await client.send_ack(response, callee)
+            print("Call is Connected")
+            await hold_call(hold, hangup)  # call time
+            if send_bye:
+                await client.send_bye(dialog, callee)
+                cdr.end, cdr.bye_by = time(), "caller"
+                await asyncio.sleep(linger)
+                print("Call is Finished")
+                isCall = False
+        elif response and "BYE sip:" in response:
+            await client.handle_bye(response, callee)
+            DIALOGS.remove(client.call_id, client.tag)
+            cdr.end, cdr.bye_by = time(), "callee"
+            print("Call is Finished")
+            isCall = False
+        elif response and client.extract_final_invite_code(response):
+            cdr.end, cdr.final_code = time(), client.extract_final_invite_code(response)
+            print(f"Call failed with {cdr.final_code}")
+            isCall = False
+    client.record_cdr(cdr)
+    return cdr
+
+
+async def answer_call(client: SIPClient, callee, send_bye, hold=3, hangup=None, linger=3, receive=None):
+    """Wait for an INVITE on an open, registered client and run the callee side until the call ends."""
+    receive = receive or client.receive_message
+    isCall = True
+    dialog = None
+    cdr = None
+    caller = None
+    while isCall:
+        response = await receive()
+        if response and "INVITE sip:" in response:
+            print("Received INVITE, sending RINGING and 200 OK")
+            caller = client.extract_caller(response)
+            client.call_id = client.extract_call_id(response)
+            cdr = CDR(client.call_id, "callee", caller, client.me, setup=time(), to_tag=client.tag)
+            await client.send_ringing(response, caller)
+            await client.send_200ok(response, caller)
+            dialog = client.dialog_from_request(response)
+            cdr.answer, cdr.final_code, cdr.from_tag = time(), 200, dialog.remote_tag
+        elif response and "ACK sip:" in response:
+            print("Call is Connected")
+            if send_bye:
+                await hold_call(hold, hangup)  # call time
+                await client.send_bye(dialog, caller)
+                cdr.end, cdr.bye_by = time(), "callee"
+                await asyncio.sleep(linger)
+                print("Call is Finished")
+                isCall = False
+        elif response and "BYE sip:" in response:
+            await client.handle_bye(response, caller)
+            DIALOGS.remove(client.call_id, client.tag)
+            if cdr is not None:
+                cdr.end, cdr.bye_by = time(), "caller"
+            print("Call is finished")
+            isCall = False
+    client.record_cdr(cdr)
+    return cdr
+
+
 async def call(client: SIPClient, callee, invite_mode, send_bye):
-    await client.create_socket()
+    await client.connect()  # Reuses the client's connection if an earlier call left it open
     client.generate_call_id()
     await client.register()
     await asyncio.sleep(1)  # Adding sleep for server response time
@@ -471,50 +1205,10 @@ async def call(client: SIPClient, callee, invite_mode, send_bye):
     if "200 OK" not in response:
         return
 
-    isCall = True
     if invite_mode:
-        await client.invite_call(callee)
-        while isCall:
-            response = await client.receive_message()
-            if response and "200 OK" in response and "Contact" in response:
-                await client.send_ack(response, callee)
-                print("Call is Connected")
-                await asyncio.sleep(3)  # call time
-                if send_bye:
-                    await client.send_bye(response, callee)
-                    await asyncio.sleep(3)
-                    print("Call is Finished")
-                    isCall = False
-            elif response and "BYE sip:" in response:
-                await client.handle_bye(response, callee)
-                print("Call is Finished")
-                isCall = False
+        await place_call(client, callee, send_bye)
     else:
-        r_invite = None
-        while isCall:
-            response = await client.receive_message()
-            caller = True
-            if response and "INVITE sip:" in response:
-                r_invite = response
-                print("Received INVITE, sending RINGING and 200 OK")
-                caller = client.extract_caller(response)
-                client.call_id = client.extract_call_id(response)
-                await client.send_ringing(response, caller)
-                await client.send_200ok(response, caller)
-            elif response and "ACK sip:" in response:
-                print("Call is Connected")
-                await asyncio.sleep(3)  # call time
-                if send_bye:
-                    await client.send_bye(r_invite, callee)
-                    await asyncio.sleep(3)
-                    print("Call is Finished")
-                    isCall = False
-            elif response and "BYE sip:" in response:
-                await client.handle_bye(response, caller)
-                print("Call is finished")
-                isCall = False
-
-
+        await answer_call(client, callee, send_bye)
 
 
 if __name__ == "__main__":
@@ -525,7 +1219,19 @@ if __name__ == "__main__":
     parser.add_argument('--send_bye', type=str, required=False, default="True", help='Send Bye (True/False)')
     parser.add_argument('--invite_mode', type=str, default="False", required=False, help='Invite Mode (True/False)')
     parser.add_argument('--callee_number', type=str, required=False, default=None, help='Callee Number')
-    parser.add_argument('--connection_type', type=str, default="tcp", help="Connection type: 'tcp', 'udp' or 'ws'")
+    parser.add_argument('--connection_type', type=str, default="tcp", help="Connection type: 'tcp', 'udp', 'ws', 'wss' or 'tls'")
+    parser.add_argument('--ws_compression', type=str, default="deflate", help="WebSocket compression: 'deflate' or 'none'")
+    parser.add_argument('--ws_context_takeover', type=str, default="True", help='Keep deflate context between messages (True/False)')
+    parser.add_argument('--tls_verify', type=str, default="True", help='Verify the server certificate for wss/tls (True/False)')
+    parser.add_argument('--tls_cafile', type=str, default=None, help='CA bundle used to verify the server certificate')
+    parser.add_argument('--keepalive_interval', type=float, default=KEEPALIVE_INTERVAL,
+                        help='Seconds between RFC 5626 CRLF / WebSocket ping keepalives (0 disables)')
+    parser.add_argument('--local_addresses', type=str, default=None,
+                        help='Comma-separated source IPs to spread connections over')
+    parser.add_argument('--local_ports', type=str, default=None, help='Source port range, e.g. 20000-29999')
+    parser.add_argument('--compact_headers', type=str, default="False", help='Use compact header names (True/False)')
+    parser.add_argument('--cdr_file', type=str, default=None, help='Write one CDR per call to this .csv or .jsonl file')
+    parser.add_argument('--coalesce', type=str, default="False", help='Batch outbound messages per event-loop tick (True/False)')
 
     args = parser.parse_args()
 
@@ -538,10 +1244,10 @@ if __name__ == "__main__":
     callee_number = args.callee_number if INVITE_MODE else None
 
     CONN = args.connection_type.lower()
-    if CONN != 'udp' and CONN != 'tcp' and CONN != 'ws':
+    if CONN not in ('udp', 'tcp', 'ws', 'wss', 'tls'):
         raise ValueError
 
-    PORT = "80" if CONN == "ws" else "5060"
+    PORT = DEFAULT_PORTS.get(CONN, "5060")
 
     print(f"invite_mode: {args.invite_mode}")
     print(f"send_bye: {args.send_bye}")
@@ -549,6 +1255,27 @@ if __name__ == "__main__":
     print(f"callee_number: {args.callee_number}")
     print(f"connection_type: {args.connection_type}")
 
-    CLIENT = SIPClient(URI, port=PORT, me=ME, connection_type=CONN)
-    asyncio.run(call(client=CLIENT, callee=callee_number, invite_mode=INVITE_MODE, send_bye=SEND_BYE))
-
+    POOL = None
+    if args.local_addresses or args.local_ports:
+        POOL = LocalAddressPool(args.local_addresses.split(",") if args.local_addresses else None,
+                                parse_port_range(args.local_ports) if args.local_ports else None)
+
+    CDR_WRITER = CDRWriter(args.cdr_file) if args.cdr_file else None
+
+    CLIENT = SIPClient(URI, port=PORT, me=ME, connection_type=CONN,
+                       ws_compression=args.ws_compression.lower(),
+                       ws_context_takeover=args.ws_context_takeover.lower() == "true",
+                       coalesce=args.coalesce.lower() == "true",
+                       tls_verify=args.tls_verify.lower() == "true", tls_cafile=args.tls_cafile,
+                       keepalive_interval=args.keepalive_interval or None, address_pool=POOL,
+                       compact_headers=args.compact_headers.lower() == "true", cdr_writer=CDR_WRITER)
+    async def main():
+        await call(client=CLIENT, callee=callee_number, invite_mode=INVITE_MODE, send_bye=SEND_BYE)
+        if CDR_WRITER is not None:
+            await CDR_WRITER.close()
+
+    asyncio.run(main())
+
+    if CONN in ('wss', 'tls'):
+        from sip_tls import TLS_SESSIONS
+        print(f"TLS handshakes: {TLS_SESSIONS.stats()}")
@@ -0,0 +1,278 @@
+"""Long-running SIP client controlled over a Unix socket, instead of one process per call.
+
+The daemon connects and REGISTERs its user agents once, keeps them alive and registered, and
+takes one JSON command per line on the control socket, answering with one JSON line:
+
+    python3 sip_daemon.py serve --uri 192.168.21.45 --connection_type ws --users 1100 --answer 1200
+    python3 sip_daemon.py ctl '{"cmd": "call", "from": "1100", "to": "1200", "hold": 3}'
+
+Commands:
+    {"cmd": "register", "user": "1100", "answer": false}   add (or re-register) a user agent
+    {"cmd": "call", "from": "1100", "to": "1200", "hold": 3, "bye": true}
+                                                 dial; without "hold" the call stays up until hangup
+    {"cmd": "hangup", "call_id": "..."}          or {"cmd": "hangup", "user": "1100"}
+    {"cmd": "stats"}
+
+The ctl path only imports the standard library, and sip_client (with websockets or TLS only when
+the transport needs them) is loaded by serve.
+"""
+import asyncio
+import argparse
+import json
+import os
+import signal
+import sys
+from contextlib import redirect_stdout
+from re import search
+
+SOCKET_PATH = "/tmp/sip_client.sock"
+REGISTER_EXPIRES = 3600  # Matches the Expires header SIPClient.register() sends
+REGISTER_TIMEOUT = 30  # Same as SIPClient.receive_message's read timeout
+
+
+class UserAgent:
+    """A warm SIPClient plus whatever call it is running.
+
+    read() is the only reader of the connection: REGISTER responses settle `registering`, and
+    everything else goes to the running call flow through receive().
+    """
+
+    def __init__(self, client, answer):
+        self.client = client
+        self.answer = answer  # Answering agents sit in answer_call() between calls
+        self.task = None
+        self.hangup = None
+        self.registered = False
+        self.registering = None  # Future for the outstanding REGISTER's final response
+        self.inbox = asyncio.Queue()
+        self.reader = None
+        self.refresher = None
+
+    async def read(self):
+        while not self.client.closing:
+            message = await self.client.receive_message()
+            if message is None:
+                continue
+            if message.startswith("SIP/2.0 ") and search(r"CSeq:\s*\d+ REGISTER", message):
+                final = not message.startswith("SIP/2.0 1")
+                if final and self.registering is not None and not self.registering.done():
+                    self.registering.set_result(message.startswith("SIP/2.0 200"))
+            elif self.task is not None:
+                self.inbox.put_nowait(message)
+            else:
+                print(f"Dropped, no call running:\n{message}")
+
+    async def receive(self):
+        return await self.inbox.get()
+
+
+class Daemon:
+    def __init__(self, uri, port, connection_type, client_options, cdr_file=None, loopback=False):
+        import sip_client
+        self.sip = sip_client
+        self.uri = uri
+        self.port = port
+        self.connection_type = connection_type
+        self.client_options = client_options
+        self.cdr_writer = None
+        if cdr_file:
+            from sip_cdr import CDRWriter
+            self.cdr_writer = CDRWriter(cdr_file)
+        self.proxy = None
+        if loopback:
+            # Self-test mode: every agent talks to an in-process fake proxy instead of the network
+            from sip_loopback import FakeProxy
+            self.proxy = FakeProxy(uri, port)
+            self.connection_type = "memory"
+        self.agents = {}
+        self.calls = {}
+        self.counters = {"calls": 0, "answered": 0, "failed": 0, "received": 0}
+
+    async def agent(self, user, answer=False):
+        """Return the user's agent, connecting and registering it on first use."""
+        agent = self.agents.get(user)
+        if agent is None:
+            client = self.sip.SIPClient(self.uri, port=self.port, me=user, connection_type=self.connection_type,
+                                        cdr_writer=self.cdr_writer, **self.client_options)
+            if self.proxy is not None:
+                self.proxy.attach(client)
+            agent = self.agents[user] = UserAgent(client, answer)
+            await client.connect()
+            client.generate_call_id()
+            loop = asyncio.get_running_loop()
+            agent.reader = loop.create_task(agent.read())
+            if answer:
+                agent.task = loop.create_task(self.answer_loop(agent))
+            await self.register(agent)
+            agent.refresher = loop.create_task(self.refresh(agent))
+        return agent
+
+    async def register(self, agent):
+        """Send a REGISTER, unless one is already outstanding, and wait for the reader to hand over its answer."""
+        registering = agent.registering
+        if registering is None:
+            registering = agent.registering = asyncio.get_running_loop().create_future()
+            await agent.client.register()
+        try:
+            agent.registered = await asyncio.wait_for(asyncio.shield(registering), REGISTER_TIMEOUT)
+        except asyncio.TimeoutError:
+            agent.registered = False
+        finally:
+            if agent.registering is registering:
+                agent.registering = None
+        return agent.registered
+
+    async def refresh(self, agent):
+        while True:
+            await asyncio.sleep(REGISTER_EXPIRES * 0.9)
+            await self.register(agent)
+
+    async def reap(self):
+        """Drop dialogs that never saw a BYE, one expiry bucket at a time."""
+        dialogs = self.sip.DIALOGS
+        while True:
+            await asyncio.sleep(dialogs.bucket)
+            dialogs.reap()
+
+    async def answer_loop(self, agent):
+        while True:
+            cdr = await self.sip.answer_call(agent.client, None, send_bye=False, linger=0, receive=agent.receive)
+            if cdr is not None:
+                self.counters["received"] += 1
+
+    async def place(self, agent, callee, hold, bye):
+        try:
+            cdr = await self.sip.place_call(agent.client, callee, bye, hold=hold, hangup=agent.hangup, linger=0,
+                                            receive=agent.receive)
+            self.counters["answered" if cdr.final_code == 200 else "failed"] += 1
+        finally:
+            self.calls.pop(agent.client.call_id, None)
+            agent.task = None
+
+    async def handle(self, request):
+        command = request.get("cmd")
+        if command == "register":
+            agent = self.agents.get(str(request["user"]))
+            if agent is None:
+                agent = await self.agent(str(request["user"]), bool(request.get("answer", False)))  # Registers it
+            else:
+                await self.register(agent)
+            return {"ok": agent.registered, "user": agent.client.me}
+        if command == "call":
+            agent = await self.agent(str(request["from"]))
+            if agent.task is not None:
+                return {"ok": False, "error": f"{agent.client.me} is busy"}
+            agent.client.generate_call_id()
+            agent.inbox = asyncio.Queue()  # Anything left over belongs to the previous call
+            agent.hangup = asyncio.Event()
+            self.calls[agent.client.call_id] = agent
+            self.counters["calls"] += 1
+            agent.task = asyncio.get_running_loop().create_task(
+                self.place(agent, str(request["to"]), request.get("hold"), bool(request.get("bye", True))))
+            return {"ok": True, "call_id": agent.client.call_id}
+        if command == "hangup":
+            agent = self.calls.get(request.get("call_id")) or self.agents.get(str(request.get("user")))
+            if agent is None or agent.hangup is None or agent.answer:
+                return {"ok": False, "error": "no such call"}
+            agent.hangup.set()
+            return {"ok": True}
+        if command == "stats":
+            return {"ok": True, **self.stats()}
+        return {"ok": False, "error": f"unknown command {command!r}"}
+
+    def stats(self):
+        stats = {
+            "agents": len(self.agents),
+            "registered": sum(agent.registered for agent in self.agents.values()),
+            "active_calls": len(self.calls),
+            **self.counters,
+            "dialogs": len(self.sip.DIALOGS),
+            "reconnects": self.sip.RECONNECTS.reconnects,
+        }
+        if "sip_tls" in sys.modules:
+            stats["tls"] = sys.modules["sip_tls"].TLS_SESSIONS.stats()
+        if self.cdr_writer is not None:
+            stats["cdrs_written"] = self.cdr_writer.written
+            stats["cdrs_dropped"] = self.cdr_writer.dropped
+        return stats
+
+    async def serve_connection(self, reader, writer):
+        while line := await reader.readline():
+            try:
+                response = await self.handle(json.loads(line))
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(response).encode('utf-8') + b"\n")
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, socket_path, users, answer_users):
+        for user in users:
+            await self.agent(user)
+        for user in answer_users:
+            await self.agent(user, answer=True)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # Left behind by a previous run
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        reaper = asyncio.get_running_loop().create_task(self.reap())
+        server = await asyncio.start_unix_server(self.serve_connection, socket_path)
+        print(f"Listening on {socket_path}", file=sys.stderr)
+        async with server:
+            await stop.wait()
+        reaper.cancel()
+        os.unlink(socket_path)
+        if self.cdr_writer is not None:
+            await self.cdr_writer.close()  # Flush CDRs still waiting for their batch
+
+
+async def ctl(socket_path, request):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(request.encode('utf-8').strip() + b"\n")
+    await writer.drain()
+    response = await reader.readline()
+    writer.close()
+    return response.decode('utf-8').strip()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent SIP client daemon.")
+    parser.add_argument('--socket', type=str, default=SOCKET_PATH, help='Control socket path')
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Run the daemon")
+    serve_parser.add_argument('--uri', type=str, default="192.168.21.45", help='Kamailio address')
+    serve_parser.add_argument('--port', type=str, default=None, help='Proxy port (default depends on transport)')
+    serve_parser.add_argument('--connection_type', type=str, default="tcp", help="tcp, ws, wss or tls")
+    serve_parser.add_argument('--users', type=str, default="", help='Comma-separated users to register at start')
+    serve_parser.add_argument('--answer', type=str, default="", help='Comma-separated users that answer calls')
+    serve_parser.add_argument('--compact_headers', type=str, default="False", help='Use compact header names (True/False)')
+    serve_parser.add_argument('--tls_verify', type=str, default="True", help='Verify the server certificate (True/False)')
+    serve_parser.add_argument('--cdr_file', type=str, default=None, help='Write CDRs to this .csv or .jsonl file')
+    serve_parser.add_argument('--loopback', type=str, default="False",
+                              help='Talk to an in-process fake proxy instead of the network (True/False)')
+    serve_parser.add_argument('--verbose', type=str, default="False", help='Print every SIP message (True/False)')
+
+    ctl_parser = commands.add_parser("ctl", help="Send one JSON command to a running daemon")
+    ctl_parser.add_argument('request', type=str, help='JSON command, e.g. \'{"cmd": "stats"}\'')
+
+    args = parser.parse_args()
+
+    if args.command == "ctl":
+        print(asyncio.run(ctl(args.socket, args.request)))
+    else:
+        from sip_client import DEFAULT_PORTS
+        CONN = args.connection_type.lower()
+        PORT = args.port or DEFAULT_PORTS.get(CONN, "5060")
+        DAEMON = Daemon(args.uri, PORT, CONN,
+                        {"compact_headers": args.compact_headers.lower() == "true",
+                         "tls_verify": args.tls_verify.lower() == "true"},
+                        cdr_file=args.cdr_file, loopback=args.loopback.lower() == "true")
+        USERS = [user for user in args.users.split(",") if user]
+        ANSWER = [user for user in args.answer.split(",") if user]
+        if args.verbose.lower() == "true":
+            asyncio.run(DAEMON.serve(args.socket, USERS, ANSWER))
+        else:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                asyncio.run(DAEMON.serve(args.socket, USERS, ANSWER))
@@ -0,0 +1,289 @@
+"""In-memory SIP network on a virtual clock, for fast and deterministic flow tests.
+
+Caller and callee SIPClients talk to a FakeProxy over MemoryTransport pairs while a
+VirtualClockLoop jumps straight to the next timer, so the sleeps inside call() cost
+no wall time. Seeding `random` makes every branch, tag and Call-ID reproducible.
+
+    python3 sip_loopback.py --flows 2000 --seed 1
+"""
+import asyncio
+import argparse
+import os
+import random
+import selectors
+import time
+from contextlib import redirect_stdout
+from hashlib import sha256
+from re import search
+
+from sip_cdr import CDRWriter
+from sip_client import SIPClient, call, normalize_message
+
+
+class VirtualClockSelector(selectors.DefaultSelector):
+    """Selector that polls without blocking and advances the loop's clock instead of waiting."""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        if timeout is None:
+            if not self.loop.executor_jobs:
+                raise RuntimeError("Virtual clock deadlock: nothing is scheduled and no I/O can arrive")
+            # No timers left, but an executor thread (e.g. a CDR write) will wake the loop, so really wait
+            return super().select(None)
+        events = super().select(0)
+        if not events:
+            self.loop.now += timeout
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time() only moves when every task is waiting on a timer."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.executor_jobs = 0  # Futures from run_in_executor that have not completed yet
+        super().__init__(VirtualClockSelector(self))
+
+    def time(self):
+        return self.now
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.executor_jobs += 1
+        future.add_done_callback(self._executor_job_done)
+        return future
+
+    def _executor_job_done(self, future):
+        self.executor_jobs -= 1
+
+
+class MemoryTransport:
+    """One end of an in-memory connection that delivers whole SIP messages in order."""
+
+    def __init__(self, address):
+        self.address = address
+        self.inbox = asyncio.Queue()
+        self.peer = None
+
+    def send(self, message):
+        self.peer.inbox.put_nowait(message)
+
+    async def recv(self):
+        return await self.inbox.get()
+
+
+def memory_pair(address, peer_address):
+    end, peer_end = MemoryTransport(address), MemoryTransport(peer_address)
+    end.peer, peer_end.peer = peer_end, end
+    return end, peer_end
+
+
+class FakeProxy:
+    """Registrar and dialog-stateful relay standing in for Kamailio.
+
+    REGISTERs are answered directly, INVITEs are Record-Routed to the registered callee,
+    and everything else is relayed to the other side of the dialog with the same Call-ID.
+    It is also the presence server: SUBSCRIBE and PUBLISH are answered here, and every
+    watcher of a presentity gets a NOTIFY when it subscribes and after each PUBLISH.
+    """
+
+    def __init__(self, address="10.0.0.1", port=5060):
+        self.address = address
+        self.port = port
+        self.registry = {}
+        self.dialogs = {}
+        self.routed = 0
+        self.watchers = {}  # Presentity -> {Call-ID: subscription} for SUBSCRIBE dialogs
+        self.subscriptions = {}
+        self.presence = {}  # Presentity -> (SIP-ETag, PIDF body) of its current publication
+        self.notify_acks = 0
+        self.digest = sha256()  # Transcript hash: equal seeds must give equal digests
+        self._tasks = []
+        self._clients = 0
+
+    def attach(self, client):
+        """Give the client a fresh in-memory connection to this proxy."""
+        self._clients += 1
+        client_address = (f"10.1.{self._clients // 250}.{self._clients % 250 + 1}", 5060)
+        client.memory, proxy_end = memory_pair(client_address, (self.address, self.port))
+        self._tasks.append(asyncio.get_running_loop().create_task(self.serve(proxy_end)))
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
+    async def serve(self, end):
+        while True:
+            self.handle(end, await end.recv())
+
+    def handle(self, end, message):
+        self.routed += 1
+        self.digest.update(message.encode('utf-8'))
+        first_line, rest = message.split("\r\n", 1)
+        # Routing decisions read long-form headers; the message itself is relayed as sent
+        normalized = normalize_message(message)
+        call_id = search(r"Call-ID:\s*([^\r\n]+)", normalized).group(1)
+
+        if first_line.startswith("REGISTER"):
+            self.registry[search(r"From:.*sip:(\d+)@", normalized).group(1)] = end
+            end.send(self.response(normalized, "200 OK"))
+        elif first_line.startswith("OPTIONS"):
+            end.send(self.response(normalized, "200 OK"))
+        elif first_line.startswith("INVITE"):
+            target = self.registry.get(search(r"sip:(\d+)@", first_line).group(1))
+            if target is None:
+                end.send(self.response(normalized, "404 Not Found"))
+                return
+            self.dialogs[call_id] = (end, target)
+            target.send(f"{first_line}\r\nRecord-Route: <sip:{self.address};lr>\r\n{rest}")
+        elif first_line.startswith("SUBSCRIBE"):
+            self.subscribe(end, normalized, call_id)
+        elif first_line.startswith("PUBLISH"):
+            self.publish(end, first_line, normalized)
+        elif call_id in self.subscriptions:
+            self.notify_acks += 1  # A watcher's response to our NOTIFY
+        elif call_id in self.dialogs:
+            caller, callee = self.dialogs[call_id]
+            (callee if end is caller else caller).send(message)
+            if first_line.startswith("SIP/2.0 200") and search(r"CSeq:\s*\d+ BYE", normalized):
+                del self.dialogs[call_id]
+
+    def subscribe(self, end, request, call_id):
+        """Accept a presence SUBSCRIBE (or its refresh) and NOTIFY the current state (RFC 6665 section 4.2.1)."""
+        expires = int(search(r"Expires:\s*(\d+)", request).group(1))
+        subscription = self.subscriptions.get(call_id)
+        if subscription is None:
+            presentity = search(r"To:.*sip:(\d+)@", request).group(1)
+            subscription = {"end": end, "presentity": presentity, "tag": f"ps{len(self.subscriptions)}",
+                            "watcher": search(r"From:\s*([^\r\n]+)", request).group(1), "cseq": 0}
+            self.subscriptions[call_id] = subscription
+            self.watchers.setdefault(presentity, {})[call_id] = subscription
+        end.send(self.response(request, "200 OK", to_tag=subscription["tag"],
+                               extra=f"Expires: {expires}\r\nContact: <sip:{subscription['presentity']}@{self.address}>\r\n"))
+        if expires == 0:
+            del self.subscriptions[call_id]
+            del self.watchers[subscription["presentity"]][call_id]
+        self.notify(call_id, subscription, expires)
+
+    def publish(self, end, first_line, request):
+        """Keep a PUBLISH as the presentity's state (RFC 3903) and NOTIFY its watchers when it changes."""
+        presentity = search(r"sip:(\d+)@", first_line).group(1)
+        etag, body = self.presence.get(presentity, (None, ""))
+        if_match = search(r"SIP-If-Match:\s*([^\r\n]+)", request)
+        if if_match and if_match.group(1) != etag:
+            end.send(self.response(request, "412 Conditional Request Failed"))
+            return
+        etag = f"e{self.routed}"
+        new_body = request.split("\r\n\r\n", 1)[1]
+        self.presence[presentity] = (etag, new_body or body)
+        expires = search(r"Expires:\s*(\d+)", request).group(1)
+        end.send(self.response(request, "200 OK", to_tag=etag, extra=f"SIP-ETag: {etag}\r\nExpires: {expires}\r\n"))
+        if new_body:
+            for call_id, subscription in self.watchers.get(presentity, {}).items():
+                self.notify(call_id, subscription, None)
+
+    def notify(self, call_id, subscription, expires):
+        presentity = subscription["presentity"]
+        body = self.presence.get(presentity, (None, ""))[1] or (
+            '<?xml version="1.0" encoding="UTF-8"?>\r\n'
+            f'<presence xmlns="urn:ietf:params:xml:ns:pidf" entity="sip:{presentity}@{self.address}">\r\n'
+            '<tuple id="t1"><status><basic>closed</basic></status><note></note></tuple>\r\n</presence>\r\n')
+        subscription["cseq"] += 1
+        state = "terminated;reason=timeout" if expires == 0 else "active" if expires is None else f"active;expires={expires}"
+        subscription["end"].send(
+            f"NOTIFY {search(r'<([^>]+)>', subscription['watcher']).group(1)} SIP/2.0\r\n"
+            f"Via: SIP/2.0/TCP {self.address}:{self.port};branch=z9hG4bKn{self.routed}x{subscription['cseq']}\r\n"
+            "Max-Forwards: 70\r\n"
+            f"From: <sip:{presentity}@{self.address}>;tag={subscription['tag']}\r\n"
+            f"To: {subscription['watcher']}\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: {subscription['cseq']} NOTIFY\r\n"
+            f"Contact: <sip:{presentity}@{self.address}>\r\n"
+            "Event: presence\r\n"
+            f"Subscription-State: {state}\r\n"
+            "Content-Type: application/pidf+xml\r\n"
+            f"Content-Length: {len(body.encode('utf-8'))}\r\n\r\n{body}")
+
+    def response(self, request, status, to_tag=None, extra=""):
+        """Answer a request, echoing its Via, From, To, Call-ID, CSeq and Contact headers.
+
+        to_tag is added to a To header that has none, and a Contact in extra replaces the echoed one.
+        """
+        echoed = ("Via", "From", "To", "Call-ID", "CSeq") if "Contact:" in extra else \
+            ("Via", "From", "To", "Call-ID", "CSeq", "Contact")
+        headers = [line for line in request.split("\r\n\r\n", 1)[0].split("\r\n")[1:]
+                   if line.split(":", 1)[0] in echoed]
+        if to_tag is not None:
+            headers = [f"{line};tag={to_tag}" if line.startswith("To:") and ";tag=" not in line else line
+                       for line in headers]
+        return f"SIP/2.0 {status}\r\n" + "\r\n".join(headers) + f"\r\n{extra}Content-Length: 0\r\n\r\n"
+
+
+async def run_flows(flows, timeout=120, compact_headers=False, proxy=None, cdr_writer=None):
+    """Run complete REGISTER/INVITE/ACK/BYE flows side by side; returns (completed, proxy)."""
+    proxy = proxy or FakeProxy()
+
+    async def flow(index):
+        caller_number, callee_number = str(100000 + index), str(500000 + index)
+        caller = SIPClient(proxy.address, port=proxy.port, me=caller_number, connection_type="memory",
+                           compact_headers=compact_headers, cdr_writer=cdr_writer)
+        callee = SIPClient(proxy.address, port=proxy.port, me=callee_number, connection_type="memory",
+                           compact_headers=compact_headers, cdr_writer=cdr_writer)
+        proxy.attach(caller)
+        proxy.attach(callee)
+        answering = asyncio.ensure_future(call(callee, None, invite_mode=False, send_bye=False))
+        await asyncio.sleep(0)  # Let the callee REGISTER before the caller dials
+        try:
+            await asyncio.wait_for(asyncio.gather(call(caller, callee_number, invite_mode=True, send_bye=True),
+                                                  answering), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    try:
+        results = await asyncio.gather(*(flow(index) for index in range(flows)))
+    finally:
+        proxy.close()
+    return sum(results), proxy
+
+
+def main(flows, seed, compact_headers=False, cdr_file=None):
+    random.seed(seed)
+    cdr_writer = CDRWriter(cdr_file) if cdr_file else None
+
+    async def run():
+        try:
+            return await run_flows(flows, compact_headers=compact_headers, cdr_writer=cdr_writer)
+        finally:
+            if cdr_writer is not None:
+                await cdr_writer.close()
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        loop = VirtualClockLoop()
+        try:
+            completed, proxy = loop.run_until_complete(run())
+            virtual_elapsed = loop.time()
+        finally:
+            loop.close()
+    elapsed = time.perf_counter() - started
+    print(f"{completed}/{flows} flows completed, {proxy.routed} messages routed")
+    print(f"virtual time {virtual_elapsed:.1f} s, wall time {elapsed:.2f} s")
+    print(f"transcript sha256 {proxy.digest.hexdigest()}")
+    if cdr_writer is not None:
+        print(f"{cdr_writer.written} CDRs written to {cdr_file}")
+    return completed == flows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run SIP call flows over an in-memory network on a virtual clock.")
+    parser.add_argument('--flows', type=int, default=1000, help='Number of caller/callee flows')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for branches, tags and Call-IDs')
+    parser.add_argument('--compact_headers', type=str, default="False", help='Use compact header names (True/False)')
+    parser.add_argument('--cdr_file', type=str, default=None, help='Write CDRs to this .csv or .jsonl file')
+    args = parser.parse_args()
+    raise SystemExit(0 if main(args.flows, args.seed, args.compact_headers.lower() == "true", args.cdr_file) else 1)
@@ -0,0 +1,449 @@
+"""Presence: SUBSCRIBE/NOTIFY (RFC 6665, RFC 3856) and PUBLISH (RFC 3903), plus a load mode.
+
+A PresenceAgent runs any number of subscriptions and one publication over a single SIPClient
+connection. One task refreshes all of them from a heap ordered by refresh time, and the 200 OKs
+for a burst of NOTIFYs are written together instead of one write per NOTIFY.
+
+The load mode holds many subscriptions from a set of watcher connections, makes every presentity
+PUBLISH, and measures how long each NOTIFY takes from the PUBLISH to the watcher:
+
+    python3 sip_presence.py --uri 192.168.21.45 --connection_type ws --watchers 100 --subscriptions 20000
+    python3 sip_presence.py --loopback True --subscriptions 20000 --presentities 50 --publishes 5
+"""
+import asyncio
+import argparse
+import heapq
+import os
+from contextlib import redirect_stdout
+from random import choices, uniform
+from re import compile as re_compile
+from string import ascii_letters, digits
+from time import perf_counter
+
+from sip_client import DEFAULT_PORTS, SIPClient, SIPHeaders, generate_branch, generate_cseq
+
+PIDF = (
+    '<?xml version="1.0" encoding="UTF-8"?>\r\n'
+    '<presence xmlns="urn:ietf:params:xml:ns:pidf" entity="{entity}">\r\n'
+    '<tuple id="t1"><status><basic>{basic}</basic></status><note>{note}</note></tuple>\r\n'
+    '</presence>\r\n'
+)
+NOTE = re_compile(r"<note>([^<]*)</note>")
+TAG = re_compile(r";tag=([^;>\s]+)")
+URI = re_compile(r"<([^>]+)>")
+# Headers a response copies from its request (RFC 3261 section 8.2.6.2)
+ECHOED_HEADERS = ("Via", "From", "To", "Call-ID", "CSeq")
+
+
+def token(k):
+    return ''.join(choices(ascii_letters + digits, k=k))
+
+
+def pidf(entity, basic="open", note=""):
+    return PIDF.format(entity=entity, basic=basic, note=note)
+
+
+def parse_message(message):
+    """Split a normalized message into its first line, the header lines a response echoes, a dict of
+    the other headers (last value wins) and the body, in one pass over the header lines."""
+    head, _, body = message.partition("\r\n\r\n")
+    lines = head.split("\r\n")
+    echoed = []
+    fields = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name in ECHOED_HEADERS:
+            echoed.append(line)
+        if name == "Record-Route":
+            fields.setdefault(name, []).append(value.strip())
+        else:
+            fields[name] = value.strip()
+    return lines[0], echoed, fields, body
+
+
+class Subscription:
+    """One SUBSCRIBE-created dialog; remote_tag and remote_target arrive with the 200 OK or first NOTIFY."""
+    __slots__ = ("call_id", "target", "local_tag", "remote_tag", "cseq", "remote_target", "route_set",
+                 "expires", "refresh_at", "state", "notifies", "last_note")
+
+    def __init__(self, call_id, target, local_tag, cseq):
+        self.call_id = call_id
+        self.target = target
+        self.local_tag = local_tag
+        self.remote_tag = None
+        self.cseq = cseq
+        self.remote_target = None
+        self.route_set = None
+        self.expires = None
+        self.refresh_at = None
+        self.state = "init"  # init, pending, active or terminated (Subscription-State)
+        self.notifies = 0  # The first NOTIFY establishes the subscription, with or without a body
+        self.last_note = None
+
+
+class PresenceAgent:
+    """Subscriptions and a PUBLISH for one connected SIPClient; run() reads and dispatches its messages.
+
+    on_notify is called as on_notify(subscription, note, received) for every NOTIFY that does not
+    end the subscription, received being the perf_counter() time it was read. note is None when
+    the NOTIFY has no PIDF note, like Kamailio's first one before anything was published.
+    NOTIFY 200 OKs are queued and written together after ack_window seconds, or as soon as
+    ack_batch of them are waiting.
+    """
+
+    def __init__(self, client, expires=3600, on_notify=None, ack_window=0.005, ack_batch=256):
+        self.client = client
+        self.expires = expires
+        self.on_notify = on_notify
+        self.ack_window = ack_window
+        self.ack_batch = ack_batch
+        self.subscriptions = {}
+        self.refreshes = []  # Heap of (refresh_at, call_id); entries whose time no longer matches are stale
+        self.publish_call_id = token(20)
+        self.publish_cseq = int(generate_cseq())
+        self.publish_refresh_at = None
+        self.etag = None
+        self.counters = {"notifies": 0, "ack_writes": 0, "refreshes": 0, "terminated": 0, "failed": 0}
+        self._acks = []
+        self._ack_task = None
+        self._ack_writes = set()  # The loop only holds tasks weakly, so ack writes are kept here
+        self._wake = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self.run()), loop.create_task(self.refresh_loop())]
+
+    async def stop(self):
+        """Stop reading and refreshing, then write every NOTIFY 200 OK still queued."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._ack_task is not None:
+            self._ack_task.cancel()
+            await asyncio.gather(self._ack_task, return_exceptions=True)
+        self.write_acks()  # The partial batch that was waiting out ack_window
+        await asyncio.gather(*self._ack_writes)
+
+    # Sending
+    async def subscribe(self, target, expires=None):
+        """Start a presence subscription to user `target`; returns the Subscription."""
+        subscription = Subscription(token(20), target, token(10), int(generate_cseq()))
+        self.subscriptions[subscription.call_id] = subscription
+        await self.send_subscribe(subscription, self.expires if expires is None else expires)
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        await self.send_subscribe(subscription, 0)
+
+    async def send_subscribe(self, subscription, expires):
+        client = self.client
+        compact = client.compact_headers
+        subscription.cseq += 1
+        request_uri = subscription.remote_target or SIPHeaders.sip_uri(client.uri, number=subscription.target)
+        routes = "".join(f"Route: {route}\r\n" for route in subscription.route_set or ())
+        sip_subscribe = (
+            f"SUBSCRIBE {request_uri} SIP/2.0\r\n"
+            f'{SIPHeaders.via_header(client.get_address(), generate_branch(), client.connection_type, compact=compact)}'
+            'Max-Forwards: 70\r\n'
+            f'{SIPHeaders.from_header(SIPHeaders.sip_uri(client.uri, number=client.me), subscription.local_tag, compact=compact)}'
+            f'{SIPHeaders.to_header(SIPHeaders.sip_uri(client.uri, number=subscription.target), subscription.remote_tag, compact=compact)}'
+            f'{SIPHeaders.call_id_header(subscription.call_id, compact=compact)}'
+            f'{SIPHeaders.cseq_header(subscription.cseq, "SUBSCRIBE")}'
+            f"{routes}"
+            f'{SIPHeaders.contact_header(SIPHeaders.sip_uri(client.local_ip, client.me, client.local_port), client.connection_type, compact=compact)}'
+            f"{SIPHeaders.header_name('Event', compact)}: presence\r\n"
+            'Accept: application/pidf+xml\r\n'
+            f'Expires: {expires}\r\n'
+            f'{SIPHeaders.content_length_header(0, compact)}\r\n'
+        )
+        await client.send_message(sip_subscribe)
+
+    async def publish(self, basic="open", note="", expires=None):
+        """PUBLISH our own presence; basic=None refreshes the current publication without a body."""
+        client = self.client
+        compact = client.compact_headers
+        me = SIPHeaders.sip_uri(client.uri, number=client.me)
+        body = "" if basic is None else pidf(me, basic, note)
+        if_match = f"SIP-If-Match: {self.etag}\r\n" if self.etag else ""
+        content_type = SIPHeaders.content_type_header("application/pidf+xml", compact) if body else ""
+        self.publish_cseq += 1
+        sip_publish = (
+            f"PUBLISH {me} SIP/2.0\r\n"
+            f'{SIPHeaders.via_header(client.get_address(), generate_branch(), client.connection_type, compact=compact)}'
+            'Max-Forwards: 70\r\n'
+            f'{SIPHeaders.from_header(me, client.tag, compact=compact)}'
+            f'{SIPHeaders.to_header(me, compact=compact)}'
+            f'{SIPHeaders.call_id_header(self.publish_call_id, compact=compact)}'
+            f'{SIPHeaders.cseq_header(self.publish_cseq, "PUBLISH")}'
+            f"{SIPHeaders.header_name('Event', compact)}: presence\r\n"
+            f'Expires: {self.expires if expires is None else expires}\r\n'
+            f"{if_match}"
+            f"{content_type}"
+            f'{SIPHeaders.content_length_header(len(body.encode("utf-8")), compact)}\r\n'
+            f"{body}"
+        )
+        await client.send_message(sip_publish)
+
+    def acknowledge(self, response):
+        """Queue a NOTIFY's 200 OK; a full batch is written right away, otherwise after ack_window."""
+        self._acks.append(response)
+        if len(self._acks) >= self.ack_batch:
+            self.write_acks()
+        elif self._ack_task is None:
+            self._ack_task = asyncio.get_running_loop().create_task(self.flush_acks())
+
+    async def flush_acks(self):
+        try:
+            await asyncio.sleep(self.ack_window)
+        finally:
+            self._ack_task = None
+        self.write_acks()
+
+    def write_acks(self):
+        """Start writing every queued 200 OK in one batch; the task is kept in _ack_writes until it is done."""
+        acks, self._acks = self._acks, []
+        if not acks:
+            return
+        self.counters["ack_writes"] += 1
+        task = asyncio.get_running_loop().create_task(self.client.write_messages(acks))
+        self._ack_writes.add(task)
+        task.add_done_callback(self._ack_writes.discard)
+
+    # Refresh scheduling
+    def schedule(self, call_id, expires):
+        """Refresh at a jittered 80-90% of the granted expiry, so a burst of subscriptions spreads its refreshes."""
+        refresh_at = asyncio.get_running_loop().time() + expires * uniform(0.8, 0.9)
+        heapq.heappush(self.refreshes, (refresh_at, call_id))
+        if self.refreshes[0][1] == call_id:
+            self._wake.set()  # New earliest refresh: the loop is sleeping for too long
+        return refresh_at
+
+    async def refresh_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wake.clear()
+            timeout = self.refreshes[0][0] - loop.time() if self.refreshes else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            now = loop.time()
+            while self.refreshes and self.refreshes[0][0] <= now:
+                refresh_at, call_id = heapq.heappop(self.refreshes)
+                if call_id == self.publish_call_id:
+                    if refresh_at == self.publish_refresh_at:
+                        await self.publish(None)
+                    continue
+                subscription = self.subscriptions.get(call_id)
+                if subscription is not None and subscription.refresh_at == refresh_at:
+                    self.counters["refreshes"] += 1
+                    await self.send_subscribe(subscription, self.expires)
+
+    # Receiving
+    async def run(self):
+        while not self.client.closing:
+            message = await self.client.receive_message()
+            if message is not None:
+                self.dispatch(message, perf_counter())
+
+    def dispatch(self, message, received):
+        first_line, echoed, fields, body = parse_message(message)
+        if first_line.startswith("NOTIFY "):
+            self.handle_notify(echoed, fields, body, received)
+        elif first_line.startswith("SIP/2.0 "):
+            self.handle_response(int(first_line[8:11]), fields)
+
+    def handle_notify(self, echoed, fields, body, received):
+        self.counters["notifies"] += 1
+        subscription = self.subscriptions.get(fields.get("Call-ID"))
+        status = "200 OK" if subscription is not None else "481 Subscription Does Not Exist"
+        self.acknowledge(f"SIP/2.0 {status}\r\n" + "\r\n".join(echoed) + "\r\nContent-Length: 0\r\n\r\n")
+        if subscription is None:
+            return
+        tag = TAG.search(fields.get("From", ""))
+        if tag:
+            subscription.remote_tag = tag.group(1)
+        contact = URI.search(fields.get("Contact", ""))
+        if contact:
+            subscription.remote_target = contact.group(1)
+        subscription.state = fields.get("Subscription-State", "active").split(";", 1)[0].strip()
+        if subscription.state == "terminated":
+            self.counters["terminated"] += 1
+            del self.subscriptions[subscription.call_id]
+            return
+        subscription.notifies += 1
+        note = NOTE.search(body)
+        if self.on_notify is not None:
+            self.on_notify(subscription, note.group(1) if note else None, received)
+
+    def handle_response(self, code, fields):
+        if code < 200:
+            return
+        call_id = fields.get("Call-ID")
+        method = fields.get("CSeq", "").rpartition(" ")[2]
+        if method == "PUBLISH" and call_id == self.publish_call_id:
+            if code < 300:
+                self.etag = fields.get("SIP-ETag", self.etag)
+                expires = int(fields.get("Expires", self.expires))
+                self.publish_refresh_at = self.schedule(call_id, expires) if expires else None
+            else:
+                self.etag = None  # 412: the publication is gone, the next PUBLISH starts a new one
+                self.counters["failed"] += 1
+            return
+        subscription = self.subscriptions.get(call_id)
+        if method != "SUBSCRIBE" or subscription is None:
+            return
+        if code >= 300:
+            self.counters["failed"] += 1
+            del self.subscriptions[call_id]
+            return
+        tag = TAG.search(fields.get("To", ""))
+        if tag:
+            subscription.remote_tag = tag.group(1)
+        contact = URI.search(fields.get("Contact", ""))
+        if contact:
+            subscription.remote_target = contact.group(1)
+        if subscription.route_set is None:
+            subscription.route_set = tuple(reversed(fields.get("Record-Route", ())))
+        subscription.expires = int(fields.get("Expires", self.expires))
+        if subscription.expires:
+            subscription.refresh_at = self.schedule(call_id, subscription.expires)
+        else:
+            del self.subscriptions[call_id]  # Unsubscribed
+
+
+class FanOutLatency:
+    """PUBLISH-to-NOTIFY latencies, matched through the note each load-mode PUBLISH carries."""
+
+    def __init__(self):
+        self.published = {}
+        self.latencies = []
+        self.initial = 0
+
+    def on_notify(self, subscription, note, received):
+        if subscription.notifies == 1:
+            self.initial += 1  # Subscribed, whether or not the server had any state to send yet
+        elif note is not None and note != subscription.last_note:  # Not the same state again after a refresh
+            sent = self.published.get((subscription.target, note))
+            if sent is not None:
+                self.latencies.append(received - sent)
+        if note is not None:
+            subscription.last_note = note
+
+    def percentile(self, fraction):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float("nan")
+
+
+async def load(uri, port, connection_type, watchers, subscriptions, presentities, publishes, interval,
+               expires=3600, rate=2000, loopback=False, client_options=None):
+    """Subscribe every watcher, PUBLISH from every presentity and wait for the NOTIFYs; returns the results."""
+    proxy = None
+    if loopback:
+        from sip_loopback import FakeProxy
+        proxy = FakeProxy(uri, int(port))
+        connection_type = "memory"
+    latency = FanOutLatency()
+
+    async def agent(user, on_notify=None):
+        client = SIPClient(uri, port=port, me=str(user), connection_type=connection_type, **(client_options or {}))
+        if proxy is not None:
+            proxy.attach(client)
+        await client.connect()
+        client.generate_call_id()
+        presence = PresenceAgent(client, expires=expires, on_notify=on_notify)
+        presence.start()
+        await client.register()
+        return presence
+
+    publishers = [await agent(300000 + index) for index in range(presentities)]
+    subscribers = [await agent(400000 + index, latency.on_notify) for index in range(watchers)]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    wall = perf_counter()
+    watching = {}
+    for index in range(subscriptions):
+        target = publishers[index % presentities].client.me
+        await subscribers[index % watchers].subscribe(target)
+        watching[target] = watching.get(target, 0) + 1
+        if rate and (index + 1) % max(1, rate // 10) == 0:
+            await asyncio.sleep(0.1)  # Pace the SUBSCRIBEs at about `rate` per second
+    while latency.initial < subscriptions and loop.time() - started < 30 + subscriptions / max(rate, 1):
+        await asyncio.sleep(0.1)
+    setup = perf_counter() - wall
+
+    expected = 0
+    for round_number in range(publishes):
+        for publisher in publishers:
+            note = f"load {round_number}"
+            latency.published[(publisher.client.me, note)] = perf_counter()
+            await publisher.publish("open" if round_number % 2 == 0 else "closed", note)
+            expected += watching.get(publisher.client.me, 0)
+        await asyncio.sleep(interval)
+    deadline = loop.time() + 30
+    while len(latency.latencies) < expected and loop.time() < deadline:
+        await asyncio.sleep(0.1)
+
+    agents = publishers + subscribers
+    notifies = sum(presence.counters["notifies"] for presence in agents)
+    ack_writes = sum(presence.counters["ack_writes"] for presence in agents)
+    refreshes = sum(presence.counters["refreshes"] for presence in agents)
+    failed = sum(presence.counters["failed"] for presence in agents)
+    for presence in agents:
+        await presence.stop()
+        await presence.client.close()
+    if proxy is not None:
+        proxy.close()
+        await asyncio.sleep(0)  # Let the proxy's cancelled tasks finish
+    return {"subscribed": latency.initial, "setup": setup, "expected": expected, "delivered": len(latency.latencies),
+            "notifies": notifies, "ack_writes": ack_writes, "refreshes": refreshes, "failed": failed,
+            "p50": latency.percentile(0.5),
+            "p90": latency.percentile(0.9), "p99": latency.percentile(0.99), "max": latency.percentile(1.0)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Presence load test: PUBLISH to NOTIFY fan-out latency.")
+    parser.add_argument('--uri', type=str, default="192.168.21.45", help='Kamailio address')
+    parser.add_argument('--port', type=str, default=None, help='Proxy port (default depends on transport)')
+    parser.add_argument('--connection_type', type=str, default="tcp", help="tcp, ws, wss or tls")
+    parser.add_argument('--watchers', type=int, default=100, help='Watcher connections holding the subscriptions')
+    parser.add_argument('--subscriptions', type=int, default=10000, help='Total presence subscriptions')
+    parser.add_argument('--presentities', type=int, default=50, help='Users that PUBLISH')
+    parser.add_argument('--publishes', type=int, default=5, help='PUBLISH rounds per presentity')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between PUBLISH rounds')
+    parser.add_argument('--expires', type=int, default=3600, help='Requested subscription and publication expiry')
+    parser.add_argument('--rate', type=int, default=2000, help='SUBSCRIBEs per second while setting up (0: no pacing)')
+    parser.add_argument('--compact_headers', type=str, default="False", help='Use compact header names (True/False)')
+    parser.add_argument('--tls_verify', type=str, default="True", help='Verify the server certificate (True/False)')
+    parser.add_argument('--loopback', type=str, default="False",
+                        help='Run against an in-process fake presence server on a virtual clock (True/False)')
+    args = parser.parse_args()
+
+    CONN = args.connection_type.lower()
+    PORT = args.port or DEFAULT_PORTS.get(CONN, "5060")
+    LOOPBACK = args.loopback.lower() == "true"
+    RUN = load(args.uri, PORT, CONN, args.watchers, args.subscriptions, args.presentities, args.publishes,
+               args.interval, args.expires, args.rate, LOOPBACK,
+               {"compact_headers": args.compact_headers.lower() == "true",
+                "tls_verify": args.tls_verify.lower() == "true"})
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        if LOOPBACK:
+            from sip_loopback import VirtualClockLoop
+            LOOP = VirtualClockLoop()
+            try:
+                RESULT = LOOP.run_until_complete(RUN)
+            finally:
+                LOOP.close()
+        else:
+            RESULT = asyncio.run(RUN)
+
+    print(f"{RESULT['subscribed']}/{args.subscriptions} subscriptions active after {RESULT['setup']:.2f} s")
+    print(f"{RESULT['delivered']}/{RESULT['expected']} PUBLISH-triggered NOTIFYs delivered")
+    print(f"fan-out latency ms: p50 {RESULT['p50'] * 1000:.2f}  p90 {RESULT['p90'] * 1000:.2f}"
+          f"  p99 {RESULT['p99'] * 1000:.2f}  max {RESULT['max'] * 1000:.2f}")
+    print(f"{RESULT['notifies']} NOTIFYs acknowledged in {RESULT['ack_writes']} writes")
+    print(f"{RESULT['refreshes']} subscription refreshes, {RESULT['failed']} failed requests")
+    raise SystemExit(0 if RESULT['delivered'] >= RESULT['expected'] else 1)
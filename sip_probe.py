@@ -0,0 +1,292 @@
+"""OPTIONS health prober for a fleet of SIP proxies, writing one JSON object per line.
+
+Every target keeps one SIPClient connection open and gets an OPTIONS every --interval seconds,
+with the targets' schedules spread across the interval. Each probe becomes one line:
+
+    {"type": "probe", "time": 1760870400.123, "target": "ws:10.0.0.1:80", "ok": true, "code": 200, "rtt_ms": 1.84}
+
+Every --summary_interval seconds (and on exit) each target gets a "summary" line with its
+availability and RTT histogram since the start, and a "state" line marks a target going down
+(--down_after failed probes in a row) or coming back up:
+
+    python3 sip_probe.py --targets udp:10.0.0.1,tcp:10.0.0.2:5070,wss://10.0.0.3 --interval 0.5
+    python3 sip_probe.py --targets_file proxies.txt --connection_type ws --duration 60 --output probes.jsonl
+"""
+import asyncio
+import argparse
+import json
+import os
+import signal
+import sys
+from bisect import bisect_left
+from contextlib import redirect_stdout
+from random import uniform
+from re import compile as re_compile
+from time import monotonic, time
+
+from sip_client import DEFAULT_PORTS, SIPClient, connection_errors
+
+TRANSPORTS = ("udp", "tcp", "tls", "ws", "wss")
+RTT_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+OPTIONS_CSEQ = re_compile(r"CSeq:\s*(\d+) OPTIONS")
+
+
+def parse_target(spec, default_transport="udp"):
+    """Turn 'udp:10.0.0.1', 'tcp:10.0.0.2:5070', 'wss://10.0.0.3' or a bare host into (transport, host, port)."""
+    transport, separator, rest = spec.partition(":")
+    if not separator or transport.lower() not in TRANSPORTS:
+        transport, rest = default_transport, spec
+    transport = transport.lower()
+    host, _, port = rest.lstrip("/").partition(":")
+    return transport, host, port or DEFAULT_PORTS.get(transport, "5060")
+
+
+class RTTHistogram:
+    """Round-trip times in fixed millisecond buckets, so a target's memory stays constant however long it is probed."""
+    __slots__ = ("counts", "total", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(RTT_BUCKETS_MS) + 1)  # The last bucket is everything above 5 s
+        self.total = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, rtt_ms):
+        self.counts[bisect_left(RTT_BUCKETS_MS, rtt_ms)] += 1
+        self.total += 1
+        self.sum += rtt_ms
+        self.min = rtt_ms if self.min is None else min(self.min, rtt_ms)
+        self.max = rtt_ms if self.max is None else max(self.max, rtt_ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the percentile, capped at the largest RTT seen."""
+        if not self.total:
+            return None
+        seen = 0
+        for bound, count in zip(RTT_BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= fraction * self.total:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        """Bucket counts keyed by their upper bound in ms, Prometheus style ("+Inf" for the last)."""
+        return {**{str(bound): count for bound, count in zip(RTT_BUCKETS_MS, self.counts)}, "+Inf": self.counts[-1]}
+
+
+class Target:
+    """One proxy: its persistent client, the OPTIONS waiting for an answer and what its probes returned."""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.cseq = 0
+        self.pending = {}  # CSeq -> future resolved with the response code
+        self.histogram = RTTHistogram()
+        self.probes = 0
+        self.answered = 0
+        self.healthy = 0
+        self.failed_in_a_row = 0
+        self.up = None  # Unknown until the first answer or down_after failures
+        self.connecting = None
+        self.reader = None
+
+
+class Prober:
+    """Probes every target on its own schedule and writes probe, state and summary records to `out`.
+
+    A probe fails on a timeout, a connection error or a 5xx/6xx answer; any answer counts
+    towards the RTT histogram.
+    """
+
+    def __init__(self, targets, out, interval=1.0, timeout=2.0, down_after=3, summary_interval=10.0):
+        self.targets = targets
+        self.out = out
+        self.interval = interval
+        self.timeout = timeout
+        self.down_after = down_after
+        self.summary_interval = summary_interval
+        self._probes = set()
+
+    def emit(self, record):
+        self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+
+    async def connect(self, target):
+        """Open the target's connection and start reading it; returns an error string or None."""
+        try:
+            await target.client.connect()
+        except (asyncio.TimeoutError, *connection_errors()) as e:
+            return f"connect: {type(e).__name__}: {e}"
+        finally:
+            target.connecting = None
+        if target.client.call_id is None:
+            target.client.generate_call_id()  # One Call-ID per target, a new CSeq per probe
+        if target.reader is None:
+            target.reader = asyncio.get_running_loop().create_task(self.read(target))
+        return None
+
+    async def read(self, target):
+        client = target.client
+        while not client.closing:
+            message = await client.receive_message()
+            if message is None or not message.startswith("SIP/2.0 "):
+                continue
+            cseq = OPTIONS_CSEQ.search(message)
+            code = int(message[8:11])
+            if cseq and code >= 200:
+                future = target.pending.pop(int(cseq.group(1)), None)
+                if future is not None and not future.done():
+                    future.set_result(code)
+
+    async def probe(self, target):
+        loop = asyncio.get_running_loop()
+        code = error = rtt_ms = None
+        if not target.client.connected:
+            if target.connecting is None:
+                target.connecting = loop.create_task(self.connect(target))
+            try:
+                # Shielded: a slow connect keeps going for the next probe instead of being cancelled
+                error = await asyncio.wait_for(asyncio.shield(target.connecting), self.timeout)
+            except asyncio.TimeoutError:
+                error = "connect: timeout"
+        if error is None:
+            target.cseq += 1
+            cseq = target.cseq
+            target.pending[cseq] = future = loop.create_future()
+            started = monotonic()
+            await target.client.send_options(cseq)
+            try:
+                code = await asyncio.wait_for(future, self.timeout)
+                rtt_ms = (monotonic() - started) * 1000
+            except asyncio.TimeoutError:
+                error = "timeout"
+            finally:
+                target.pending.pop(cseq, None)
+        self.record(target, code, error, rtt_ms)
+
+    def record(self, target, code, error, rtt_ms):
+        target.probes += 1
+        record = {"type": "probe", "time": round(time(), 3), "target": target.name}
+        if code is not None:
+            target.answered += 1
+            target.histogram.add(rtt_ms)
+            record.update(ok=code < 500, code=code, rtt_ms=round(rtt_ms, 3))
+        else:
+            record.update(ok=False, error=error)
+        if record["ok"]:
+            target.healthy += 1
+            target.failed_in_a_row = 0
+            up = True
+        else:
+            target.failed_in_a_row += 1
+            up = False if target.failed_in_a_row >= self.down_after else target.up
+        self.emit(record)
+        if up != target.up:
+            target.up = up
+            self.emit({"type": "state", "time": record["time"], "target": target.name, "up": up})
+
+    def summary(self, target):
+        histogram = target.histogram
+        return {
+            "type": "summary", "time": round(time(), 3), "target": target.name, "up": target.up,
+            "probes": target.probes, "answered": target.answered,
+            "availability": round(target.healthy / target.probes, 4) if target.probes else None,
+            "rtt_ms": {name: None if value is None else round(value, 3) for name, value in (
+                ("min", histogram.min), ("mean", histogram.sum / histogram.total if histogram.total else None),
+                ("p50", histogram.percentile(0.5)), ("p90", histogram.percentile(0.9)),
+                ("p99", histogram.percentile(0.99)), ("max", histogram.max))},
+            "histogram": histogram.as_dict(),
+        }
+
+    async def schedule(self, target):
+        loop = asyncio.get_running_loop()
+        next_at = loop.time() + uniform(0, self.interval)  # Spread the targets across the interval
+        while True:
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            next_at = max(next_at + self.interval, loop.time())  # Skip ticks missed while the loop was busy
+            task = loop.create_task(self.probe(target))
+            self._probes.add(task)
+            task.add_done_callback(self._probes.discard)
+
+    async def summaries(self):
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            for target in self.targets:
+                self.emit(self.summary(target))
+
+    async def run(self, duration=None):
+        """Probe until SIGINT/SIGTERM or `duration` seconds, then write a final summary per target."""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        tasks = [loop.create_task(self.schedule(target)) for target in self.targets]
+        tasks.append(loop.create_task(self.summaries()))
+        try:
+            await asyncio.wait_for(stop.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        for task in (*tasks, *self._probes):
+            task.cancel()
+        await asyncio.gather(*tasks, *self._probes, return_exceptions=True)
+        for target in self.targets:
+            self.emit(self.summary(target))
+            if target.reader is not None:
+                target.reader.cancel()
+            await target.client.close()
+
+
+def build_targets(specs, default_transport, username="probe", loopback=False, client_options=None):
+    """One Target per spec; with loopback every client is attached to a single in-process FakeProxy."""
+    proxy = None
+    if loopback:
+        from sip_loopback import FakeProxy
+        proxy = FakeProxy()
+    targets = []
+    for spec in specs:
+        transport, host, port = parse_target(spec, default_transport)
+        client = SIPClient(host, port=port, me=username, connection_type="memory" if loopback else transport,
+                           keepalive_interval=None, **(client_options or {}))  # The probes are the keepalive
+        if proxy is not None:
+            proxy.attach(client)
+        targets.append(Target(f"{transport}:{host}:{port}", client))
+    return targets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OPTIONS health prober for SIP proxies (JSON lines output).")
+    parser.add_argument('--targets', type=str, default="", help="Comma-separated targets, e.g. 'udp:10.0.0.1,wss://10.0.0.2:443'")
+    parser.add_argument('--targets_file', type=str, default=None, help='File with one target per line (# comments)')
+    parser.add_argument('--connection_type', type=str, default="udp", help='Transport for targets given without one')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between probes of each target')
+    parser.add_argument('--timeout', type=float, default=2.0, help='Seconds to wait for an answer')
+    parser.add_argument('--down_after', type=int, default=3, help='Failed probes in a row before a target is down')
+    parser.add_argument('--summary_interval', type=float, default=10.0, help='Seconds between summary records')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds (default: run until interrupted)')
+    parser.add_argument('--output', type=str, default=None, help='Append records to this file instead of stdout')
+    parser.add_argument('--username', type=str, default="probe", help='User part of the From header')
+    parser.add_argument('--tls_verify', type=str, default="True", help='Verify server certificates for wss/tls (True/False)')
+    parser.add_argument('--tls_cafile', type=str, default=None, help='CA bundle used to verify server certificates')
+    parser.add_argument('--loopback', type=str, default="False",
+                        help='Probe an in-process fake proxy instead of the network (True/False)')
+    args = parser.parse_args()
+
+    SPECS = [spec.strip() for spec in args.targets.split(",") if spec.strip()]
+    if args.targets_file:
+        with open(args.targets_file) as f:
+            SPECS += [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+    if not SPECS:
+        parser.error("no targets given")
+
+    OUT = open(args.output, "a") if args.output else sys.stdout
+
+    async def main():
+        targets = build_targets(SPECS, args.connection_type.lower(), args.username, args.loopback.lower() == "true",
+                                {"tls_verify": args.tls_verify.lower() == "true", "tls_cafile": args.tls_cafile})
+        await Prober(targets, OUT, args.interval, args.timeout, args.down_after, args.summary_interval).run(args.duration)
+
+    # The clients print every message they send and receive; keep that out of the JSON stream
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        asyncio.run(main())
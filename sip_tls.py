@@ -0,0 +1,85 @@
+"""TLS contexts and process-wide session resumption for the wss and tls transports.
+
+Imported by sip_client only when a wss or tls connection is opened.
+"""
+import ssl
+from time import perf_counter
+
+
+class TimedSSLObject(ssl.SSLObject):
+    """SSLObject that reports how long its handshake took and whether the session was resumed."""
+
+    def do_handshake(self):
+        # asyncio calls this repeatedly until the handshake stops asking for more data
+        if getattr(self, "_handshake_started", None) is None:
+            self._handshake_started = perf_counter()
+        super().do_handshake()
+        self.context.session_cache.record(self, perf_counter() - self._handshake_started)
+
+
+class SessionContext(ssl.SSLContext):
+    """SSLContext for a single server that offers the last session it saw on every new connection."""
+    sslobject_class = TimedSSLObject
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None:
+            session = self.session_cache.sessions.get(self.session_key)
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+
+class TLSSessionCache:
+    """Process-wide TLS session store shared by every SIPClient, so reconnects skip full handshakes.
+
+    OpenSSL only resumes a session with the context that created it, so one context is kept per server.
+    """
+
+    def __init__(self):
+        self.contexts = {}
+        self.sessions = {}
+        self.full = 0
+        self.resumed = 0
+        self.full_time = 0.0
+        self.resumed_time = 0.0
+
+    def context(self, host, port, verify=True, cafile=None):
+        key = (host, port, verify, cafile)
+        context = self.contexts.get(key)
+        if context is None:
+            context = SessionContext(ssl.PROTOCOL_TLS_CLIENT)
+            if verify and cafile:
+                context.load_verify_locations(cafile)
+            elif verify:
+                context.load_default_certs()
+            else:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            context.session_cache = self
+            context.session_key = key
+            self.contexts[key] = context
+        return context
+
+    def remember(self, ssl_object):
+        """Keep the connection's session; TLS 1.3 tickets only arrive after the first read."""
+        session = ssl_object.session
+        if session is not None and (session.has_ticket or session.id):
+            self.sessions[ssl_object.context.session_key] = session
+
+    def record(self, ssl_object, elapsed):
+        if ssl_object.session_reused:
+            self.resumed += 1
+            self.resumed_time += elapsed
+        else:
+            self.full += 1
+            self.full_time += elapsed
+        self.remember(ssl_object)
+
+    def stats(self):
+        return {
+            "full_handshakes": self.full,
+            "resumed_handshakes": self.resumed,
+            "full_handshake_ms": round(self.full_time * 1000, 3),
+            "resumed_handshake_ms": round(self.resumed_time * 1000, 3),
+        }
+
+
+TLS_SESSIONS = TLSSessionCache()